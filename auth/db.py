@@ -1,23 +1,72 @@
+import logging
+import time
 from collections.abc import AsyncGenerator
 from fastapi import Depends
 from datetime import datetime
 import uuid
 from sqlalchemy.dialects.postgresql import UUID
 from fastapi_users.db import SQLAlchemyBaseUserTableUUID, SQLAlchemyUserDatabase
-from sqlalchemy import String, Integer, TIMESTAMP, ForeignKey, Boolean
+from sqlalchemy import (String, Integer, BigInteger, TIMESTAMP, ForeignKey, Boolean, Sequence, LargeBinary, Index, text,
+                        event, CheckConstraint)
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from config import DATABASE_URL
-
-import logging
-logging.basicConfig()
-logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+from config import (DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+                    DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE, DB_ECHO, WEB_CONCURRENCY,
+                    DB_MAX_CONNECTIONS_BUDGET)
+from models.models import url_digest, LINKS_HASH_PARTITIONS
+from metrics import DB_POOL_CHECKOUT_SECONDS, DB_POOL_CHECKED_OUT
 
 
 class Base(DeclarativeBase):
     pass
 
-engine = create_async_engine(DATABASE_URL)
+link_code_block_seq = Sequence("link_code_block_seq", metadata=Base.metadata)
+
+# пул, который замеряет ожидание соединения (включая открытие нового соединения)
+class TimedQueuePool(AsyncAdaptedQueuePool):
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+# SQL пишется логгером sqlalchemy.engine в общий обработчик логов приложения (main.py), а не через echo:
+# echo добавил бы свой обработчик, и каждая строка выводилась бы дважды
+ECHO_LEVELS = {"": None, "false": None, "info": logging.INFO, "true": logging.INFO, "debug": logging.DEBUG}
+if ECHO_LEVELS[DB_ECHO] is not None:
+    logging.getLogger("sqlalchemy.engine").setLevel(ECHO_LEVELS[DB_ECHO])
+
+# движок с общими настройками пула; используется и для основной БД, и для реплик
+def create_db_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    return create_async_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+    )
+
+
+engine = create_db_engine(DATABASE_URL)
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(*args):
+    DB_POOL_CHECKED_OUT.inc()
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _on_checkin(*args):
+    DB_POOL_CHECKED_OUT.dec()
+
+
 async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit = False)
 
 
@@ -45,23 +94,90 @@ class Link(Base):
         UUID(as_uuid=True), primary_key=True, index=True, default=uuid.uuid4
     )
     original_url: Mapped[str] = mapped_column(String, nullable=False)
-    short_code: Mapped[str] = mapped_column(String, unique=True, nullable=False)
-    custom_alias: Mapped[str] = mapped_column(String, unique=True, nullable=True)
+    short_code: Mapped[str] = mapped_column(String, primary_key=True, unique=True, nullable=False)
+    custom_alias: Mapped[str] = mapped_column(String, nullable=True)
     clicks: Mapped[int] = mapped_column(Integer, default=0)
-    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
     last_accessed: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
     expires_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
     user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("user.id"), nullable=True)
+    url_digest: Mapped[bytes] = mapped_column(
+        LargeBinary, nullable=True,
+        default=lambda context: url_digest(context.get_current_parameters()["original_url"])
+    )
     user: Mapped["User"] = relationship("User", back_populates="links")
 
+    __table_args__ = (
+        Index("ix_links_url_digest_created_at", "url_digest", "created_at", "id"),
+        Index("ix_links_expires_at", "expires_at", postgresql_where=expires_at.isnot(None)),
+        Index("ix_links_user_id_created_at", "user_id", "created_at", "id"),
+        # самые кликаемые ссылки для прогрева кэша (stream_top_links)
+        Index("ix_links_clicks_top", clicks.desc().nulls_last(), expires_at, postgresql_where=clicks > 0),
+        CheckConstraint("custom_alias IS NULL OR custom_alias = short_code", name="links_custom_alias_check"),
+        {"postgresql_partition_by": "HASH (short_code)"},
+    )
+
+
+class LinkClicksHourly(Base):
+    __tablename__ = "link_clicks_hourly"
+
+    short_code: Mapped[str] = mapped_column(String, primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    clicks: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = {"postgresql_partition_by": "RANGE (bucket)"}
+
+
+class LinkClicksDaily(Base):
+    __tablename__ = "link_clicks_daily"
+
+    short_code: Mapped[str] = mapped_column(String, primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    clicks: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
 
+# проверка при старте: все воркеры вместе не должны превысить лимит соединений Postgres
+def validate_pool_budget():
+    per_worker = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    total = per_worker * WEB_CONCURRENCY
+    if DB_MAX_CONNECTIONS_BUDGET and total > DB_MAX_CONNECTIONS_BUDGET:
+        raise RuntimeError(
+            f"Пулы {WEB_CONCURRENCY} воркеров могут открыть до {total} соединений "
+            f"(DB_POOL_SIZE + DB_MAX_OVERFLOW = {per_worker} на воркер), "
+            f"а DB_MAX_CONNECTIONS_BUDGET = {DB_MAX_CONNECTIONS_BUDGET}"
+        )
+
+
+def get_pool_stats():
+    pool = engine.pool
+    return {
+        "pool_size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "workers": WEB_CONCURRENCY,
+        "connections_budget": DB_MAX_CONNECTIONS_BUDGET or None,
+    }
+
+
 async def create_db_and_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS link_clicks_hourly_default PARTITION OF link_clicks_hourly DEFAULT"
+        ))
+        for remainder in range(LINKS_HASH_PARTITIONS):
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS links_p{remainder} PARTITION OF links "
+                f"FOR VALUES WITH (MODULUS {LINKS_HASH_PARTITIONS}, REMAINDER {remainder})"
+            ))
 
 async def get_link_db(session: AsyncSession = Depends(get_async_session)):
     yield session
@@ -0,0 +1,160 @@
+import asyncio
+import itertools
+import logging
+from collections.abc import AsyncGenerator
+from sqlalchemy import text, bindparam, String
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from auth.db import create_db_engine, async_session_maker, engine
+from config import (DB_REPLICA_HOSTS, DB_REPLICA_URLS, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW,
+                    DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+# позиция WAL основной БД на момент проверки реплик
+PRIMARY_LSN_QUERY = text("SELECT pg_current_wal_lsn()::text")
+
+# отставание реплики в секундах; 0, если она применила все WAL, записанные основной БД к началу проверки
+# (иначе при простое основной БД время последней транзакции выглядело бы как отставание).
+# Сравнение с позицией основной БД, а не с полученными репликой WAL: реплика с оборванной репликацией
+# применяет все полученное и иначе считалась бы догнавшей. Позиция основной БД неизвестна (NULL) -
+# отставание считается от последней примененной транзакции. NULL в ответе - реплика еще ничего не применила
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_replay_lsn() >= CAST(:primary_lsn AS pg_lsn) THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""").bindparams(bindparam("primary_lsn", type_=String))
+
+
+async def primary_wal_lsn():
+    try:
+        async with engine.connect() as conn:
+            return (await conn.execute(PRIMARY_LSN_QUERY)).scalar()
+    except Exception as e:
+        logger.warning("Не удалось получить позицию WAL основной БД: %s", e)
+        return None
+
+
+class Replica:
+
+    def __init__(self, name, url):
+        self.name = name
+        self.engine = create_db_engine(url, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW)
+        self.session_maker = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        # пока проверка не прошла, реплика не используется
+        self.healthy = False
+        self.lag = None
+        self.error = None
+
+    async def check(self, primary_lsn=None):
+        try:
+            async with self.engine.connect() as conn:
+                lag = (await conn.execute(REPLICA_LAG_QUERY, {"primary_lsn": primary_lsn})).scalar()
+            self.lag = None if lag is None else float(lag)
+            self.error = None
+            self.healthy = self.lag is not None and self.lag <= DB_REPLICA_MAX_LAG
+        except Exception as e:
+            self.healthy = False
+            self.error = str(e)
+
+    def mark_failed(self, error):
+        self.healthy = False
+        self.error = str(error)
+
+
+# чтение распределяется по здоровым репликам по кругу; если таких нет - идет в основную БД
+class ReplicaSet:
+
+    def __init__(self, urls, names):
+        self.replicas = [Replica(name, url) for name, url in zip(names, urls)]
+        self._counter = itertools.count()
+
+    def pick(self):
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    async def check_all(self):
+        primary_lsn = await primary_wal_lsn()
+        await asyncio.gather(*(replica.check(primary_lsn) for replica in self.replicas))
+
+    def status(self):
+        return [
+            {"name": replica.name, "healthy": replica.healthy, "lag": replica.lag, "error": replica.error}
+            for replica in self.replicas
+        ]
+
+    async def dispose(self):
+        await asyncio.gather(*(replica.engine.dispose() for replica in self.replicas))
+
+
+replica_set = ReplicaSet(DB_REPLICA_URLS, DB_REPLICA_HOSTS)
+
+
+# фабрика сессий для чтения: реплика, если есть здоровая, иначе основная БД
+def read_session_maker():
+    replica = replica_set.pick()
+    if replica is None:
+        return async_session_maker
+    return replica.session_maker
+
+
+def session_replica(session):
+    return session.info.get("replica")
+
+
+# зависимость для эндпоинтов, которые только читают и допускают отставание до DB_REPLICA_MAX_LAG
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    replica = replica_set.pick()
+    if replica is None:
+        async with async_session_maker() as session:
+            yield session
+        return
+
+    async with replica.session_maker() as session:
+        session.info["replica"] = replica
+        yield session
+
+
+# выполняет чтение на реплике; если реплика недоступна, повторяет запрос на основной БД.
+# Пустой результат повторяется на основной БД, только если при последней проверке реплика отставала:
+# тогда строка могла быть записана позже, чем реплика ее применила. Догнавшей реплике верим,
+# иначе каждый 404 (например, от сканеров) стоил бы двух запросов. Только что созданные ссылки
+# редирект берет из кэша Redis, куда они пишутся при создании. primary_on_empty=True - пустой
+# результат всегда повторяется на основной БД (статистика сразу после создания ссылки).
+# Возвращает (результат, реплика или None, если ответила основная БД)
+async def read_with_fallback(read_db, primary_db, query, *args, primary_on_empty=False, **kwargs):
+    replica = session_replica(read_db)
+    if replica is None:
+        return await query(read_db, *args, **kwargs), None
+
+    try:
+        result = await query(read_db, *args, **kwargs)
+    except (DBAPIError, OSError) as e:
+        logger.warning("Реплика %s недоступна, чтение из основной БД: %s", replica.name, e)
+        replica.mark_failed(e)
+        await read_db.rollback()
+        return await query(primary_db, *args, **kwargs), None
+
+    if not result and (primary_on_empty or replica.lag != 0):
+        return await query(primary_db, *args, **kwargs), None
+    return result, replica
+
+
+# фоновая задача, запускается из lifespan: проверяет доступность и отставание реплик
+async def run_replica_health_checks():
+    if not replica_set.replicas:
+        return
+    try:
+        while True:
+            await replica_set.check_all()
+            for replica in replica_set.replicas:
+                if not replica.healthy:
+                    logger.warning("Реплика %s исключена из чтения: lag=%s, error=%s",
+                                   replica.name, replica.lag, replica.error)
+            await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+    finally:
+        await replica_set.dispose()
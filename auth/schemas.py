@@ -1,7 +1,7 @@
 import uuid
 from fastapi_users import schemas
 from pydantic import BaseModel, HttpUrl
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 
 
@@ -41,18 +41,35 @@ class LinkResponse(BaseModel):
     expires_at: datetime
 
 
+class UserLinkResponse(BaseModel):
+    id: uuid.UUID
+    original_url: str
+    short_code: str
+    custom_alias: Optional[str] = None
+    clicks: int
+    created_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    last_accessed: Optional[datetime] = None
+
+
 class LinkUpdate(BaseModel):
     original_url: Optional[HttpUrl] = None
     custom_alias: None
     expires_at: datetime
 
 
+class ClickBucket(BaseModel):
+    bucket: datetime
+    clicks: int
+
+
 class LinkStatistics(BaseModel):
     original_url: str
     short_code: str
     clicks: int
-    last_accessed: datetime = None
-    expires_at: datetime = None
+    last_accessed: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    series: Optional[List[ClickBucket]] = None
 
 
 class CustomAlias(BaseModel):
@@ -61,3 +78,23 @@ class CustomAlias(BaseModel):
     custom_alias: str
     expires_at: datetime = None
     new_expires_at: datetime = None
+
+
+class LinkBatchItem(BaseModel):
+    original_url: HttpUrl
+    custom_alias: Optional[str] = None
+    expires_at: Optional[datetime] = None
+
+
+class LinkBatchItemResult(BaseModel):
+    index: int
+    short_code: Optional[str] = None
+    original_url: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class LinkBatchResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[LinkBatchItemResult]
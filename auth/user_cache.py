@@ -0,0 +1,100 @@
+import json
+import time
+import uuid
+import jwt
+from fastapi_users.jwt import decode_jwt
+from cache import LocalCache, register_invalidation_channel
+from config import AUTH_CACHE_MAX_SIZE, AUTH_TOKEN_CACHE_TTL, AUTH_USER_LOCAL_TTL, AUTH_USER_REDIS_TTL
+
+# Кэш аутентификации: проверенный токен -> id пользователя (в памяти воркера)
+# и id пользователя -> данные пользователя (в памяти воркера и в Redis).
+# При изменении или удалении пользователя запись сбрасывается во всех воркерах.
+
+USER_CACHE_KEY_PREFIX = "fl:u:"
+USER_INVALIDATION_CHANNEL = "fl:users:invalidate"
+
+token_cache = LocalCache(AUTH_CACHE_MAX_SIZE, AUTH_TOKEN_CACHE_TTL, layer="auth_token")
+user_cache = LocalCache(AUTH_CACHE_MAX_SIZE, AUTH_USER_LOCAL_TTL, layer="auth_user")
+
+register_invalidation_channel(USER_INVALIDATION_CHANNEL, user_cache.invalidate, user_cache.clear)
+
+
+# данные пользователя, которые нужны обработчикам; вместо ORM-объекта User
+class UserPrincipal:
+    __slots__ = ("id", "email", "username", "is_active", "is_superuser", "is_verified")
+
+    def __init__(self, id, email, username, is_active, is_superuser, is_verified):
+        self.id = id
+        self.email = email
+        self.username = username
+        self.is_active = is_active
+        self.is_superuser = is_superuser
+        self.is_verified = is_verified
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.email, user.username, user.is_active, user.is_superuser, user.is_verified)
+
+    def to_bytes(self):
+        return json.dumps([str(self.id), self.email, self.username,
+                           self.is_active, self.is_superuser, self.is_verified]).encode()
+
+    @classmethod
+    def from_bytes(cls, value):
+        user_id, *fields = json.loads(value)
+        return cls(uuid.UUID(user_id), *fields)
+
+
+def user_key(user_id):
+    return f"{USER_CACHE_KEY_PREFIX}{user_id}"
+
+
+# проверяет подпись и срок токена, результат запоминается не дольше срока действия токена;
+# None - токен недействителен
+def read_token_user_id(token, strategy):
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+
+    try:
+        data = decode_jwt(token, strategy.decode_key, strategy.token_audience, algorithms=[strategy.algorithm])
+    except jwt.PyJWTError:
+        return None
+    user_id = data.get("sub")
+    if user_id is None:
+        return None
+
+    ttl = AUTH_TOKEN_CACHE_TTL
+    if data.get("exp"):
+        ttl = min(ttl, data["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(token, user_id, ttl)
+    return user_id
+
+
+async def get_cached_principal(user_id, redis_client):
+    principal = user_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    value = await redis_client.get(user_key(user_id))
+    if value is None:
+        return None
+
+    principal = UserPrincipal.from_bytes(value)
+    user_cache.set(user_id, principal)
+    return principal
+
+
+async def cache_principal(principal, redis_client):
+    user_cache.set(str(principal.id), principal)
+    await redis_client.set(user_key(principal.id), principal.to_bytes(), ex=AUTH_USER_REDIS_TTL)
+
+
+# сбрасывает данные пользователя во всех воркерах
+async def invalidate_user(user_id, redis_client):
+    user_cache.invalidate(str(user_id))
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(user_key(user_id))
+        pipe.publish(USER_INVALIDATION_CHANNEL, str(user_id))
+        await pipe.execute()
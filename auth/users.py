@@ -1,8 +1,9 @@
+import logging
 import uuid
 from typing import Optional
 
-from fastapi import Depends, Request
-from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, models
+from fastapi import Depends, Request, HTTPException, status
+from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, models, exceptions
 from fastapi_users.authentication import (
     AuthenticationBackend,
     BearerTransport,
@@ -11,26 +12,45 @@ from fastapi_users.authentication import (
 from fastapi_users.db import SQLAlchemyUserDatabase
 
 from auth.db import User, get_user_db
+from auth.user_cache import (UserPrincipal, read_token_user_id, get_cached_principal, cache_principal,
+                             invalidate_user)
+from cache import get_redis
 
 SECRET = "SECRET"
 
+logger = logging.getLogger(__name__)
+
 
 class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     reset_password_token_secret = SECRET
     verification_token_secret = SECRET
 
     async def on_after_register(self, user: User, request: Optional[Request] = None):
-        print(f"User {user.id} has registered.")
+        logger.info("User %s has registered.", user.id)
 
     async def on_after_forgot_password(
         self, user: User, token: str, request: Optional[Request] = None
     ):
-        print(f"User {user.id} has forgot their password. Reset token: {token}")
+        logger.info("User %s has forgot their password. Reset token: %s", user.id, token)
 
     async def on_after_request_verify(
         self, user: User, token: str, request: Optional[Request] = None
     ):
-        print(f"Verification requested for user {user.id}. Verification token: {token}")
+        logger.info("Verification requested for user %s. Verification token: %s", user.id, token)
+
+    # изменение, верификация и удаление пользователя сбрасывают его данные в кэше аутентификации
+    async def on_after_update(self, user: User, update_dict: dict, request: Optional[Request] = None):
+        await self._invalidate_cached_user(user, request)
+
+    async def on_after_verify(self, user: User, request: Optional[Request] = None):
+        await self._invalidate_cached_user(user, request)
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        await self._invalidate_cached_user(user, request)
+
+    async def _invalidate_cached_user(self, user: User, request: Optional[Request]):
+        if request is not None:
+            await invalidate_user(user.id, request.app.state.redis)
 
 
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
@@ -52,4 +72,45 @@ auth_backend = AuthenticationBackend(
 
 fastapi_users = FastAPIUsers[User, uuid.UUID](get_user_manager, [auth_backend])
 
-get_current_user = fastapi_users.current_user(active=True)
\ No newline at end of file
+
+# активный пользователь по токену или None; пользователь из БД читается, только если его нет в кэше аутентификации
+async def _read_active_user(token, user_manager, redis_client):
+    user_id = read_token_user_id(token, get_jwt_strategy()) if token else None
+    if user_id is None:
+        return None
+
+    principal = await get_cached_principal(user_id, redis_client)
+    if principal is None:
+        try:
+            user = await user_manager.get(user_manager.parse_id(user_id))
+        except (exceptions.UserNotExists, exceptions.InvalidID):
+            return None
+        principal = UserPrincipal.from_user(user)
+        await cache_principal(principal, redis_client)
+
+    if not principal.is_active:
+        return None
+    return principal
+
+
+# текущий активный пользователь; в отличие от fastapi_users.current_user(active=True)
+# не читает пользователя из БД, если он есть в кэше аутентификации.
+# Возвращает UserPrincipal, а не ORM-объект User
+async def get_current_user(
+        token: Optional[str] = Depends(bearer_transport.scheme),
+        user_manager: UserManager = Depends(get_user_manager),
+        redis_client=Depends(get_redis),
+):
+    principal = await _read_active_user(token, user_manager, redis_client)
+    if principal is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return principal
+
+
+# то же для маршрутов, доступных без входа: None вместо 401
+async def get_optional_user(
+        token: Optional[str] = Depends(bearer_transport.scheme),
+        user_manager: UserManager = Depends(get_user_manager),
+        redis_client=Depends(get_redis),
+):
+    return await _read_active_user(token, user_manager, redis_client)
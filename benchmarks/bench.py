@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+# Нагрузочный прогон эндпоинтов redirect, shorten, shorten/custom и stats.
+#
+# По умолчанию приложение поднимается в этом же процессе (httpx + ASGI, с lifespan),
+# Postgres берется из .env (например, из docker-compose), Redis можно заменить на fakeredis
+# флагом --fake-redis. С --base-url запросы идут в уже запущенный сервер.
+#
+#   python -m benchmarks.bench --links 10000 --requests 20000 --output bench.json
+#   python -m benchmarks.bench --compare old.json new.json
+
+
+def zipf_sampler(items, exponent, rng):
+    # популярность i-го элемента пропорциональна 1 / i^exponent
+    weights = [1 / (rank ** exponent) for rank in range(1, len(items) + 1)]
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+
+    def sample(count):
+        return rng.choices(items, cum_weights=cumulative, k=count)
+
+    return sample
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name, latencies, elapsed, statuses, statements=None):
+    result = {
+        "scenario": name,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+    }
+    if statements is not None:
+        result["db_statements_per_request"] = round(statements / len(latencies), 3)
+    return result
+
+
+class StatementCounter:
+    # считает запросы к БД, если приложение работает в этом же процессе
+
+    def __init__(self):
+        self.count = 0
+        self._engine = None
+
+    def attach(self, engine):
+        from sqlalchemy import event
+        self._engine = engine.sync_engine
+        event.listen(self._engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+async def run_requests(name, client, make_request, count, concurrency, before_each=None, counter=None):
+    latencies = []
+    statuses = {}
+    queue = iter(range(count))
+    statements_before = counter.count if counter else 0
+
+    async def worker():
+        for index in queue:
+            if before_each:
+                before_each()
+            started = time.perf_counter()
+            response = await make_request(client, index)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    statements = counter.count - statements_before if counter else None
+    return summarize(name, latencies, elapsed, statuses, statements)
+
+
+@asynccontextmanager
+async def in_process_client(fake_redis):
+    # все запросы идут с одного адреса: лимиты из .env мерили бы 429, а не эндпоинты
+    os.environ["RATE_LIMITS"] = ""
+    import main
+
+    if fake_redis:
+        import fakeredis
+        main.create_redis_client = lambda: fakeredis.aioredis.FakeRedis()
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client, main.app
+
+
+@asynccontextmanager
+async def remote_client(base_url):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        yield client, None
+
+
+async def authenticate(client):
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    password = uuid.uuid4().hex
+    response = await client.post("/auth/register", json={
+        "id": str(uuid.uuid4()),
+        "email": email,
+        "username": email,
+        "password": password,
+    })
+    response.raise_for_status()
+
+    response = await client.post("/auth/jwt/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def seed_links(client, headers, count, chunk_size=5000):
+    codes = []
+    for start in range(0, count, chunk_size):
+        lines = [
+            json.dumps({"original_url": f"https://example.com/bench/{uuid.uuid4().hex}/{index}"})
+            for index in range(start, min(count, start + chunk_size))
+        ]
+        response = await client.post(
+            "/links/shorten/batch",
+            content="\n".join(lines),
+            headers={**headers, "content-type": "application/x-ndjson"},
+            timeout=300,
+        )
+        response.raise_for_status()
+        codes.extend(item["short_code"] for item in response.json()["results"] if item["short_code"])
+    return codes
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    client_factory = remote_client(args.base_url) if args.base_url else in_process_client(args.fake_redis)
+
+    async with client_factory as (client, app):
+        counter = None
+        local_cache = None
+        redis_client = None
+        if app is not None:
+            from auth.db import engine
+            from cache import local_cache
+            counter = StatementCounter()
+            counter.attach(engine)
+            redis_client = app.state.redis
+
+        headers = await authenticate(client)
+        codes = await seed_links(client, headers, args.links)
+        sample = zipf_sampler(codes, args.zipf, rng)
+        traffic = sample(args.requests)
+
+        async def redirect(client, index):
+            return await client.get(f"/links/{traffic[index]}", follow_redirects=False)
+
+        # случайные несуществующие коды, как у сканеров; каждый запрашивается один раз
+        missing_codes = [f"missing{uuid.UUID(int=rng.getrandbits(128)).hex[:12]}" for _ in range(args.requests)]
+
+        async def redirect_missing(client, index):
+            return await client.get(f"/links/{missing_codes[index]}", follow_redirects=False)
+
+        async def stats(client, index):
+            return await client.get(f"/links/{traffic[index]}/stats")
+
+        expires_at = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+
+        async def shorten(client, index):
+            return await client.post("/links/shorten", headers=headers, json={
+                "original_url": f"https://example.com/shorten/{uuid.uuid4().hex}",
+                "custom_alias": "string",
+                "clicks": None,
+                "expires_at": expires_at,
+            })
+
+        async def shorten_custom(client, index):
+            return await client.post("/links/shorten/custom", headers=headers, json={
+                "original_url": f"https://example.com/custom/{uuid.uuid4().hex}",
+                "short_code": traffic[index],
+                "custom_alias": f"b{uuid.uuid4().hex[:10]}",
+                "expires_at": expires_at,
+                "new_expires_at": expires_at,
+            })
+
+        results = []
+
+        # холодный кэш: Redis и L1 пусты, первые запросы по каждому коду идут в БД
+        if redis_client is not None:
+            await redis_client.flushdb()
+            local_cache.clear()
+            results.append(await run_requests("redirect_cold", client, redirect, args.requests,
+                                              args.concurrency, counter=counter))
+            # теплый Redis, пустой L1
+            results.append(await run_requests("redirect_warm_redis", client, redirect, args.requests,
+                                              args.concurrency, before_each=local_cache.clear, counter=counter))
+        results.append(await run_requests("redirect_l1", client, redirect, args.requests,
+                                          args.concurrency, counter=counter))
+        # фильтр Блума удален вместе с остальными ключами Redis, собираем его заново
+        if redis_client is not None:
+            from bloom_rebuild import rebuild_bloom_filter
+            await rebuild_bloom_filter(redis_client)
+        results.append(await run_requests("redirect_missing", client, redirect_missing, args.requests,
+                                          args.concurrency, counter=counter))
+        results.append(await run_requests("stats", client, stats, args.requests,
+                                          args.concurrency, counter=counter))
+        results.append(await run_requests("shorten", client, shorten, args.shorten_requests,
+                                          args.concurrency, counter=counter))
+        results.append(await run_requests("shorten_custom", client, shorten_custom, args.shorten_requests,
+                                          args.concurrency, counter=counter))
+
+    report = {
+        "revision": git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "params": {
+            "links": args.links,
+            "requests": args.requests,
+            "shorten_requests": args.shorten_requests,
+            "concurrency": args.concurrency,
+            "zipf": args.zipf,
+            "seed": args.seed,
+            "mode": "remote" if args.base_url else ("in-process, fakeredis" if args.fake_redis else "in-process"),
+        },
+        "results": results,
+    }
+    return report
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {item["scenario"]: item for item in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {item["scenario"]: item for item in json.load(f)["results"]}
+
+    metrics = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "db_statements_per_request")
+    print(f"{'scenario':<22}{'metric':<28}{'old':>12}{'new':>12}{'change':>10}")
+    for scenario in new:
+        if scenario not in old:
+            continue
+        for metric in metrics:
+            before, after = old[scenario].get(metric), new[scenario].get(metric)
+            if before is None or after is None:
+                continue
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "-"
+            print(f"{scenario:<22}{metric:<28}{before:>12}{after:>12}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк эндпоинтов redirect, shorten и stats")
+    parser.add_argument("--base-url", help="адрес запущенного сервера; без него приложение поднимается в процессе")
+    parser.add_argument("--fake-redis", action="store_true", help="fakeredis вместо Redis (только в процессе)")
+    parser.add_argument("--links", type=int, default=10000, help="сколько ссылок создать перед прогоном")
+    parser.add_argument("--requests", type=int, default=20000, help="запросов на сценарий redirect/stats")
+    parser.add_argument("--shorten-requests", type=int, default=2000, help="запросов на сценарий shorten")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--zipf", type=float, default=1.1, help="показатель распределения Ципфа")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два файла результатов")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import math
+from redis.exceptions import NoScriptError
+from metrics import CACHE_LOOKUPS
+from config import BLOOM_FILTER_ENABLED, BLOOM_EXPECTED_ITEMS, BLOOM_FALSE_POSITIVE_RATE
+
+logger = logging.getLogger(__name__)
+
+# Фильтр Блума по всем существующим коротким кодам - битовая строка в Redis, общая для всех воркеров.
+# Если хотя бы один бит кода не установлен, ссылки точно нет, и редирект отвечает 404 без обращения к БД.
+# Пока фильтр не собран (первый старт, перезапуск Redis), ключа нет и проверка ничего не отсекает.
+# Фильтр, восстановленный Redis из снимка после перезапуска, удаляется фоновой проверкой (bloom_rebuild.py).
+# Удалить код из фильтра нельзя: удаленные коды дают ложные срабатывания (обычный запрос к БД)
+# до следующей пересборки.
+
+BLOOM_BITS = math.ceil(-BLOOM_EXPECTED_ITEMS * math.log(BLOOM_FALSE_POSITIVE_RATE) / math.log(2) ** 2)
+BLOOM_HASHES = max(1, round(BLOOM_BITS / BLOOM_EXPECTED_ITEMS * math.log(2)))
+
+# параметры входят в имя ключа: после их изменения старый фильтр не используется
+BLOOM_KEY = f"fl:bloom:{BLOOM_BITS}:{BLOOM_HASHES}"
+# фильтр, который собирается из таблицы; новые коды пишутся и в него, пока он не заменит BLOOM_KEY
+BLOOM_BUILD_KEY = f"{BLOOM_KEY}:build"
+# существует, пока фильтр не старше BLOOM_REBUILD_INTERVAL
+BLOOM_FRESH_KEY = f"{BLOOM_KEY}:fresh"
+# run_id Redis, в котором собран фильтр: после перезапуска Redis может восстановить фильтр из снимка (RDB/AOF)
+# без кодов, созданных после снимка, и такому фильтру верить нельзя
+BLOOM_RUN_ID_KEY = f"{BLOOM_KEY}:run_id"
+
+# устанавливает биты только в существующих ключах: частично заполненный фильтр отсекал бы живые коды
+ADD_SCRIPT = """
+for k = 1, #KEYS do
+    if redis.call('EXISTS', KEYS[k]) == 1 then
+        for i = 1, #ARGV do
+            redis.call('SETBIT', KEYS[k], ARGV[i], 1)
+        end
+    end
+end
+return 0
+"""
+ADD_SHA = hashlib.sha1(ADD_SCRIPT.encode()).hexdigest()
+
+BLOOM_ABSENT = CACHE_LOOKUPS.labels("bloom", "absent")
+BLOOM_MAYBE = CACHE_LOOKUPS.labels("bloom", "maybe")
+
+
+# номера битов кода: двойное хэширование одного blake2b
+def bloom_offsets(short_code):
+    digest = hashlib.blake2b(str(short_code).encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:], "big") | 1
+    return [(h1 + i * h2) % BLOOM_BITS for i in range(BLOOM_HASHES)]
+
+
+async def set_bloom_bits(short_codes, redis_client, keys):
+    offsets = [offset for short_code in short_codes for offset in bloom_offsets(short_code)]
+    if not offsets:
+        return
+    try:
+        await redis_client.evalsha(ADD_SHA, len(keys), *keys, *offsets)
+    except NoScriptError:
+        await redis_client.eval(ADD_SCRIPT, len(keys), *keys, *offsets)
+
+
+# добавляет новые коды; вызывается до коммита, чтобы ни один воркер не успел ответить 404 на созданную ссылку.
+# Ошибка Redis пробрасывается: ссылка без битов в фильтре была бы недоступна до пересборки
+async def add_short_codes(short_codes, redis_client):
+    if not BLOOM_FILTER_ENABLED:
+        return
+    await set_bloom_bits(short_codes, redis_client, [BLOOM_KEY, BLOOM_BUILD_KEY])
+
+
+# повторно добавляет коды в собираемый фильтр после коммита. Если коммит случился после начала чтения
+# таблицы при пересборке, строки нет в снимке, но BLOOM_BUILD_KEY к этому моменту уже существует
+async def confirm_short_codes(short_codes, redis_client):
+    if not BLOOM_FILTER_ENABLED:
+        return
+    await set_bloom_bits(short_codes, redis_client, [BLOOM_BUILD_KEY])
+
+
+# ставит проверку в пайплайн (например, рядом с чтением кэша); False - фильтр отключен
+def queue_bloom_check(pipe, short_code):
+    if not BLOOM_FILTER_ENABLED:
+        return False
+    pipe.exists(BLOOM_KEY)
+    pipe.execute_command("BITFIELD", BLOOM_KEY, *[arg for offset in bloom_offsets(short_code)
+                                                  for arg in ("GET", "u1", offset)])
+    return True
+
+
+# результат двух команд проверки; True - кода точно нет
+def bloom_absent(exists, bits):
+    if isinstance(exists, Exception) or isinstance(bits, Exception):
+        logger.warning("Не удалось проверить фильтр Блума: %s", exists if isinstance(exists, Exception) else bits)
+        return False
+    absent = bool(exists) and not all(bits)
+    (BLOOM_ABSENT if absent else BLOOM_MAYBE).inc()
+    return absent
+
+
+async def short_code_absent(short_code, redis_client):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        if not queue_bloom_check(pipe, short_code):
+            return False
+        exists, bits = await pipe.execute(raise_on_error=False)
+    return bloom_absent(exists, bits)
@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+from auth.db import async_session_maker
+from services import stream_short_codes
+from bloom import BLOOM_KEY, BLOOM_BUILD_KEY, BLOOM_FRESH_KEY, BLOOM_RUN_ID_KEY, BLOOM_BITS, set_bloom_bits
+from cache import create_redis_client, close_redis_client
+from single_flight import release_lease
+from config import BLOOM_FILTER_ENABLED, BLOOM_REBUILD_INTERVAL, BLOOM_REBUILD_CHUNK_SIZE, LOG_LEVEL, LOG_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# пересборку выполняет один воркер, остальные пропускают ее
+BLOOM_LOCK_KEY = "fl:bloom:lock"
+BLOOM_LOCK_TTL = 3600
+# как часто воркеры проверяют, не пропал ли фильтр, не перезапускался ли Redis и не пора ли пересобрать фильтр.
+# После перезапуска Redis с восстановленным фильтром коды, созданные после снимка, могут получать 404
+# не дольше этого интервала (плюс L1_CACHE_NEGATIVE_TTL)
+BLOOM_CHECK_INTERVAL = 5
+
+# 1 - фильтра нет или он собран в другом запуске Redis (тогда он удаляется), 0 - фильтру можно верить
+CHECK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 1
+end
+if redis.call('GET', KEYS[3]) ~= ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+    return 1
+end
+return 0
+"""
+
+
+async def redis_run_id(redis_client):
+    info = await redis_client.info("server")
+    return info["run_id"]
+
+
+# собирает фильтр заново из таблицы links и атомарно заменяет им текущий; None - пересборка уже идет.
+# Коды, закоммиченные после начала чтения таблицы, попадают в новый фильтр через confirm_short_codes
+async def rebuild_bloom_filter(redis_client, chunk_size=BLOOM_REBUILD_CHUNK_SIZE):
+    token = uuid.uuid4().hex
+    if not await redis_client.set(BLOOM_LOCK_KEY, token, nx=True, ex=BLOOM_LOCK_TTL):
+        return None
+
+    loaded = 0
+    started = time.monotonic()
+    try:
+        # если Redis перезапустится во время сборки, фильтр с этим run_id будет отброшен проверкой
+        run_id = await redis_run_id(redis_client)
+        # пустая битовая строка полного размера; с этого момента новые коды пишутся и в нее
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(BLOOM_BUILD_KEY)
+            pipe.setbit(BLOOM_BUILD_KEY, BLOOM_BITS - 1, 0)
+            await pipe.execute()
+
+        async with async_session_maker() as db:
+            async for short_codes in stream_short_codes(db, chunk_size):
+                await set_bloom_bits(short_codes, redis_client, [BLOOM_BUILD_KEY])
+                loaded += len(short_codes)
+
+        # ключ мог быть вытеснен из Redis во время сборки - тогда текущий фильтр остается
+        if not await redis_client.exists(BLOOM_BUILD_KEY):
+            logger.warning("Фильтр Блума пропал из Redis во время пересборки")
+            return None
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.rename(BLOOM_BUILD_KEY, BLOOM_KEY)
+            pipe.set(BLOOM_RUN_ID_KEY, run_id)
+            if BLOOM_REBUILD_INTERVAL > 0:
+                pipe.set(BLOOM_FRESH_KEY, 1, ex=int(BLOOM_REBUILD_INTERVAL))
+            await pipe.execute()
+    finally:
+        await release_lease(BLOOM_LOCK_KEY, token, redis_client)
+
+    logger.info("Фильтр Блума пересобран: %s кодов за %.1f с", loaded, time.monotonic() - started)
+    return loaded
+
+
+# нужна ли пересборка: фильтра нет, он собран до перезапуска Redis или старше BLOOM_REBUILD_INTERVAL
+async def bloom_rebuild_due(redis_client):
+    run_id = await redis_run_id(redis_client)
+    if await redis_client.eval(CHECK_SCRIPT, 3, BLOOM_KEY, BLOOM_FRESH_KEY, BLOOM_RUN_ID_KEY, run_id):
+        return True
+    return BLOOM_REBUILD_INTERVAL > 0 and not await redis_client.exists(BLOOM_FRESH_KEY)
+
+
+# фоновая задача, запускается из lifespan. Фильтр общий для всех воркеров, поэтому перезапуск воркера
+# его не пересобирает: пересборка идет, только если фильтра нет, Redis перезапускался или фильтр устарел,
+# и только в одном воркере
+async def run_bloom_filter_rebuild(redis_client):
+    if not BLOOM_FILTER_ENABLED:
+        return
+    while True:
+        try:
+            if await bloom_rebuild_due(redis_client):
+                await rebuild_bloom_filter(redis_client)
+        except Exception:
+            logger.exception("Не удалось пересобрать фильтр Блума")
+        await asyncio.sleep(BLOOM_CHECK_INTERVAL)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пересборка фильтра Блума коротких кодов из таблицы links")
+    parser.add_argument("--chunk-size", type=int, default=BLOOM_REBUILD_CHUNK_SIZE, help="размер пачки")
+    args = parser.parse_args()
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    redis_client = create_redis_client()
+    try:
+        loaded = await rebuild_bloom_filter(redis_client, args.chunk_size)
+        if loaded is None:
+            print("Пересборка уже выполняется или не завершилась")
+        else:
+            print(f"Загружено кодов: {loaded}")
+    finally:
+        await close_redis_client(redis_client)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
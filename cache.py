@@ -1,39 +1,346 @@
-import json
+import asyncio
+import logging
+import random
+import struct
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+import redis.asyncio as redis
+from fastapi import Request
+from config import (REDIS_HOST, REDIS_PORT, REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT,
+                    REDIS_SOCKET_TIMEOUT, REDIS_CONNECT_TIMEOUT, CACHE_KEY_PREFIX,
+                    CACHE_MAX_TTL, CACHE_TTL_JITTER, CACHE_SLIDING_TTL,
+                    L1_CACHE_MAX_SIZE, L1_CACHE_TTL, L1_CACHE_NEGATIVE_TTL)
+from metrics import CACHE_OPERATION_SECONDS, CACHE_LOOKUPS
 
+logger = logging.getLogger(__name__)
 
-# кэширует
-def create_cache_url(short_code, original_url, clicks, expires_at, redis_client, last_accessed=0):
+# канал, через который воркеры сообщают друг другу об изменении ссылок
+INVALIDATION_CHANNEL = "fl:links:invalidate"
+
+# формат значения в Redis: версия, клики, expires_at и last_accessed (секунды эпохи, 0 - нет значения),
+# затем оригинальный URL в utf-8
+CACHE_FORMAT_VERSION = 1
+CACHE_HEADER = struct.Struct("!BQqq")
+
+
+# политика времени жизни ключей: min(expires_at - now, max_ttl) минус случайный джиттер
+class ExpiryAwareTtl:
+
+    def __init__(self, max_ttl, jitter, sliding):
+        self.max_ttl = max_ttl
+        self.jitter = jitter
+        self.sliding = sliding
+
+    # 0 - ссылка уже истекла и кэшировать ее не нужно
+    def ttl(self, expires_at, now=None):
+        ttl = self.max_ttl
+        if expires_at is not None:
+            remaining = (expires_at - (now or datetime.now(timezone.utc))).total_seconds()
+            ttl = min(ttl, remaining)
+        if ttl <= 0:
+            return 0
+        return max(1, int(ttl * (1 - self.jitter * random.random())))
+
+
+ttl_policy = ExpiryAwareTtl(CACHE_MAX_TTL, CACHE_TTL_JITTER, CACHE_SLIDING_TTL)
+
+
+def link_ttl(expires_at, now=None):
+    return ttl_policy.ttl(expires_at, now)
+
+
+class _MissingLink:
+    # метка "ссылки точно нет", ведет себя как пустой результат
+    def __bool__(self):
+        return False
+
+
+MISSING_LINK = _MissingLink()
+
+# дочерние метрики создаются заранее, чтобы не искать их по меткам на каждом запросе
+REDIS_GET_SECONDS = CACHE_OPERATION_SECONDS.labels("get")
+REDIS_SET_SECONDS = CACHE_OPERATION_SECONDS.labels("set")
+REDIS_SET_MANY_SECONDS = CACHE_OPERATION_SECONDS.labels("set_many")
+REDIS_DELETE_SECONDS = CACHE_OPERATION_SECONDS.labels("delete")
+REDIS_HITS = CACHE_LOOKUPS.labels("redis", "hit")
+REDIS_MISSES = CACHE_LOOKUPS.labels("redis", "miss")
+
+
+# LRU-кэш с TTL в памяти воркера
+class LocalCache:
+
+    def __init__(self, max_size, ttl, negative_ttl=None, layer="l1"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self._hits_metric = CACHE_LOOKUPS.labels(layer, "hit")
+        self._negative_hits_metric = CACHE_LOOKUPS.labels(layer, "negative_hit")
+        self._misses_metric = CACHE_LOOKUPS.labels(layer, "miss")
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            self._misses_metric.inc()
+            return None
+
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            self._misses_metric.inc()
+            return None
+
+        self._data.move_to_end(key)
+        if value is MISSING_LINK:
+            self.negative_hits += 1
+            self._negative_hits_metric.inc()
+        else:
+            self.hits += 1
+            self._hits_metric.inc()
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def set_missing(self, key):
+        self.set(key, MISSING_LINK, self.negative_ttl)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+local_cache = LocalCache(L1_CACHE_MAX_SIZE, L1_CACHE_TTL, L1_CACHE_NEGATIVE_TTL)
+
+# каналы инвалидации локальных кэшей: канал -> (сброс одного ключа, сброс всего кэша)
+invalidation_handlers = {INVALIDATION_CHANNEL: (local_cache.invalidate, local_cache.clear)}
+
+
+def register_invalidation_channel(channel, invalidate, clear):
+    invalidation_handlers[channel] = (invalidate, clear)
+
+
+# создает клиент Redis с общим пулом соединений
+def create_redis_client():
+    pool = redis.BlockingConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT
+    )
+    return redis.Redis.from_pool(pool)
+
+
+# закрывает клиент вместе с пулом
+async def close_redis_client(redis_client):
+    await redis_client.aclose()
 
-    data = {
-        'original_url': original_url,
+
+# зависимость: клиент Redis, созданный в lifespan
+def get_redis(request: Request):
+    return request.app.state.redis
+
+
+def cache_key(short_code):
+    return f"{CACHE_KEY_PREFIX}{short_code}"
+
+
+def _to_timestamp(value):
+    return int(value.timestamp()) if value else 0
+
+
+def _from_timestamp(value):
+    return datetime.fromtimestamp(value, timezone.utc) if value else None
+
+
+# упаковывает ссылку в компактное бинарное значение
+def encode_link(original_url, clicks, expires_at, last_accessed):
+    header = CACHE_HEADER.pack(
+        CACHE_FORMAT_VERSION,
+        clicks or 0,
+        _to_timestamp(expires_at),
+        _to_timestamp(last_accessed)
+    )
+    return header + original_url.encode()
+
+
+# распаковывает значение из Redis, для неизвестной версии формата возвращает None
+def decode_link(short_code, value):
+    if len(value) < CACHE_HEADER.size or value[0] != CACHE_FORMAT_VERSION:
+        return None
+
+    _, clicks, expires_at, last_accessed = CACHE_HEADER.unpack_from(value)
+    return {
+        'original_url': value[CACHE_HEADER.size:].decode(),
         'short_code': short_code,
         'clicks': clicks,
-        'expires_at': str(expires_at),
-        'last_accessed': str(last_accessed)
+        'expires_at': _from_timestamp(expires_at),
+        'last_accessed': _from_timestamp(last_accessed)
     }
 
-    json_data = json.dumps(data)
-    print(json_data)
 
-    redis_client.setex(short_code, 3600, json_data)
+# кэширует
+async def create_cache_url(short_code, original_url, clicks, expires_at, redis_client, last_accessed=None,
+                           max_ttl=None):
+    ttl = link_ttl(expires_at)
+    if not ttl:
+        return
+    if max_ttl:
+        ttl = min(ttl, max_ttl)
+
+    value = encode_link(original_url, clicks, expires_at, last_accessed)
+
+    with REDIS_SET_SECONDS.time():
+        await redis_client.setex(cache_key(short_code), ttl, value)
+    local_cache.set(short_code, decode_link(short_code, value))
+
+
+# кэширует пачку ссылок одним пайплайном (локальный кэш не заполняется);
+# overwrite=False не трогает ключи, которые уже есть в Redis
+async def create_cache_urls(links, redis_client, overwrite=True):
+    now = datetime.now(timezone.utc)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for link in links:
+            ttl = link_ttl(link.expires_at, now)
+            if ttl:
+                value = encode_link(link.original_url, link.clicks, link.expires_at, link.last_accessed)
+                pipe.set(cache_key(link.short_code), value, ex=ttl, nx=not overwrite)
+        with REDIS_SET_MANY_SECONDS.time():
+            await pipe.execute()
 
 
-# забирает из кэша
-def get_cached_url(short_code, redis_client):
+# забирает из кэша: сначала из памяти воркера, затем из Redis
+async def get_cached_url(short_code, redis_client):
     short_code = str(short_code)
-    cached_data = redis_client.get(short_code)
+    data = local_cache.get(short_code)
+    if data is not None:
+        return data
 
-    if cached_data is not None:
-        try:
-            data = json.loads(cached_data)
-            return data
-        except json.JSONDecodeError:
-            return None
+    async with redis_client.pipeline(transaction=False) as pipe:
+        queue_cache_get(pipe, short_code)
+        with REDIS_GET_SECONDS.time():
+            cached_data, = await pipe.execute()
+    return load_cached_value(short_code, cached_data)
+
+
+# чтение ссылки из Redis в пайплайне; при скользящем TTL срок ключа продлевается той же командой GETEX.
+# Срок ссылки до чтения неизвестен, поэтому ключ продлевается на CACHE_MAX_TTL: истекшую ссылку
+# из кэша обработчики все равно не отдают, проверяя expires_at
+def queue_cache_get(pipe, short_code):
+    if ttl_policy.sliding:
+        pipe.getex(cache_key(short_code), ex=link_ttl(None))
     else:
+        pipe.get(cache_key(short_code))
+
 
+# разбирает значение, прочитанное из Redis (в том числе в чужом пайплайне), и кладет его в локальный кэш
+def load_cached_value(short_code, cached_data):
+    if cached_data is None:
+        REDIS_MISSES.inc()
         return None
+    REDIS_HITS.inc()
+
+    data = decode_link(short_code, cached_data)
+    if data is not None:
+        local_cache.set(short_code, data)
+    return data
+
+
+# запоминает, что ссылки с таким кодом нет
+def cache_missing_link(short_code):
+    local_cache.set_missing(str(short_code))
+
 
-# удаляет из кэша
-def delete_cached_link(short_code, redis_client):
-    print(short_code)
-    redis_client.delete(short_code)
+# удаляет из кэша во всех воркерах
+async def delete_cached_link(short_code, redis_client):
+    local_cache.invalidate(short_code)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(cache_key(short_code))
+        pipe.publish(INVALIDATION_CHANNEL, short_code)
+        with REDIS_DELETE_SECONDS.time():
+            await pipe.execute()
+
+
+# после изменения ссылки: удаляет старые коды и кэширует ссылку под новым кодом одной транзакцией MULTI,
+# другие воркеры сбрасывают у себя и старые коды, и новый (там мог остаться отрицательный результат)
+async def replace_cached_link(old_short_codes, short_code, original_url, clicks, expires_at, redis_client,
+                              last_accessed=None):
+    stale = [code for code in dict.fromkeys(old_short_codes) if code and code != short_code]
+    for code in stale:
+        local_cache.invalidate(code)
+    local_cache.invalidate(short_code)
+
+    ttl = link_ttl(expires_at)
+    value = encode_link(original_url, clicks, expires_at, last_accessed)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        if stale:
+            pipe.delete(*[cache_key(code) for code in stale])
+        if ttl:
+            pipe.set(cache_key(short_code), value, ex=ttl)
+        else:
+            pipe.delete(cache_key(short_code))
+        for code in stale + [short_code]:
+            pipe.publish(INVALIDATION_CHANNEL, code)
+        with REDIS_SET_SECONDS.time():
+            await pipe.execute()
+
+
+# удаляет пачку ссылок из кэша во всех воркерах одним пайплайном
+async def delete_cached_links(short_codes, redis_client):
+    if not short_codes:
+        return
+
+    for short_code in short_codes:
+        local_cache.invalidate(short_code)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(*[cache_key(short_code) for short_code in short_codes])
+        for short_code in short_codes:
+            pipe.publish(INVALIDATION_CHANNEL, short_code)
+        await pipe.execute()
+
+
+# фоновая задача: сбрасывает локальные кэши по сообщениям других воркеров
+async def run_invalidation_listener(redis_client):
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(*invalidation_handlers)
+            while True:
+                message = await pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    invalidate, _ = invalidation_handlers[message['channel'].decode()]
+                    invalidate(message['data'].decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # пока подписка не работала, сообщения могли потеряться
+            logger.exception("Потеряно соединение с каналом инвалидации кэша")
+            for _, clear in invalidation_handlers.values():
+                clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from auth.db import async_session_maker
+from services import update_link_statistics_batch, ensure_click_partitions
+from single_flight import release_lease
+from config import CLICKS_FLUSH_INTERVAL, CLICKS_FLUSH_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# счетчики кликов и время последнего перехода, накопленные с прошлого сброса
+PENDING_CLICKS_KEY = "fl:clicks:pending"
+PENDING_ACCESSED_KEY = "fl:clicks:last_accessed"
+
+# порция, которая сейчас записывается в БД; ключи общие, сбрасывает тот воркер, что держит блокировку.
+# Если воркер упал посреди сброса, блокировка истекает и остаток порции дописывает другой воркер
+FLUSHING_CLICKS_KEY = "fl:clicks:flushing"
+FLUSHING_ACCESSED_KEY = "fl:clicks:flushing_last_accessed"
+FLUSH_LOCK_KEY = "fl:clicks:flush:lock"
+FLUSH_LOCK_TTL = 60
+
+# атомарно забирает накопленные счетчики, чтобы новые клики шли в чистый хэш
+TAKE_PENDING_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[3])
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('RENAME', KEYS[2], KEYS[4])
+end
+return 1
+"""
+
+
+# ставит учет перехода в пайплайн (например, рядом с проверкой лимита)
+def queue_click(pipe, short_code):
+    pipe.hincrby(PENDING_CLICKS_KEY, short_code, 1)
+    pipe.hset(PENDING_ACCESSED_KEY, short_code, datetime.now(timezone.utc).timestamp())
+
+# переносит несброшенные клики со старого кода на новый в накопленной и сбрасываемой порциях;
+# KEYS - пары (хэш кликов, хэш времени перехода), ARGV - старый и новый код
+MOVE_CLICKS_SCRIPT = """
+for i = 1, #KEYS, 2 do
+    local count = redis.call('HGET', KEYS[i], ARGV[1])
+    if count then
+        redis.call('HINCRBY', KEYS[i], ARGV[2], count)
+        redis.call('HDEL', KEYS[i], ARGV[1])
+    end
+    local accessed = redis.call('HGET', KEYS[i + 1], ARGV[1])
+    if accessed then
+        local current = redis.call('HGET', KEYS[i + 1], ARGV[2])
+        if not current or tonumber(accessed) > tonumber(current) then
+            redis.call('HSET', KEYS[i + 1], ARGV[2], accessed)
+        end
+        redis.call('HDEL', KEYS[i + 1], ARGV[1])
+    end
+end
+return 0
+"""
+
+
+# учитывает переход по ссылке (один round trip в Redis)
+async def record_click(short_code, redis_client):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        queue_click(pipe, short_code)
+        await pipe.execute()
+
+
+# отменяет клик, учтенный вместе с проверкой лимита, если запрос был отклонен
+async def uncount_click(short_code, redis_client):
+    await redis_client.hincrby(PENDING_CLICKS_KEY, short_code, -1)
+
+
+# после смены короткого кода клики, еще не записанные в БД, засчитываются новому коду
+async def move_pending_clicks(old_short_code, new_short_code, redis_client):
+    await redis_client.eval(
+        MOVE_CLICKS_SCRIPT, 4,
+        PENDING_CLICKS_KEY, PENDING_ACCESSED_KEY, FLUSHING_CLICKS_KEY, FLUSHING_ACCESSED_KEY,
+        old_short_code, new_short_code
+    )
+
+
+# клики, которые еще не записаны в БД: накопленные и сбрасываемые сейчас
+async def get_pending_clicks(short_code, redis_client):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hget(PENDING_CLICKS_KEY, short_code)
+        pipe.hget(FLUSHING_CLICKS_KEY, short_code)
+        counts = await pipe.execute()
+    return sum(int(count) for count in counts if count)
+
+
+# переносит накопленные клики в БД пачками; одновременно сбрасывает только один воркер
+async def flush_clicks(redis_client):
+    token = uuid.uuid4().hex
+    if not await redis_client.set(FLUSH_LOCK_KEY, token, nx=True, ex=FLUSH_LOCK_TTL):
+        return 0
+    try:
+        return await _flush_clicks(redis_client)
+    finally:
+        await release_lease(FLUSH_LOCK_KEY, token, redis_client)
+
+
+async def _flush_clicks(redis_client):
+    # порция, оставшаяся после неудачного сброса или упавшего воркера, отправляется первой
+    if not await redis_client.exists(FLUSHING_CLICKS_KEY):
+        taken = await redis_client.eval(
+            TAKE_PENDING_SCRIPT, 4,
+            PENDING_CLICKS_KEY, PENDING_ACCESSED_KEY, FLUSHING_CLICKS_KEY, FLUSHING_ACCESSED_KEY
+        )
+        if not taken:
+            return 0
+
+    clicks = await redis_client.hgetall(FLUSHING_CLICKS_KEY)
+    accessed = await redis_client.hgetall(FLUSHING_ACCESSED_KEY)
+
+    stats = []
+    for short_code, delta in clicks.items():
+        timestamp = accessed.get(short_code)
+        last_accessed = datetime.fromtimestamp(float(timestamp), timezone.utc) if timestamp else None
+        stats.append((short_code.decode(), int(delta), last_accessed))
+
+    async with async_session_maker() as db:
+        for start in range(0, len(stats), CLICKS_FLUSH_BATCH_SIZE):
+            batch = stats[start:start + CLICKS_FLUSH_BATCH_SIZE]
+            await update_link_statistics_batch(db, batch)
+            # записанная пачка не должна попасть в БД повторно при следующей попытке
+            await redis_client.hdel(FLUSHING_CLICKS_KEY, *[short_code for short_code, _, _ in batch])
+
+    await redis_client.delete(FLUSHING_CLICKS_KEY, FLUSHING_ACCESSED_KEY)
+    return len(stats)
+
+
+# фоновая задача, запускается из lifespan
+async def run_click_flusher(redis_client):
+    partitions_month = None
+    try:
+        while True:
+            await asyncio.sleep(CLICKS_FLUSH_INTERVAL)
+            # секции почасовой статистики создаются заранее, при смене месяца; ошибка здесь
+            # не должна останавливать сброс кликов (без секции строки попадут в секцию DEFAULT)
+            month = datetime.now(timezone.utc).strftime("%Y%m")
+            if month != partitions_month:
+                try:
+                    async with async_session_maker() as db:
+                        await ensure_click_partitions(db)
+                    partitions_month = month
+                except Exception:
+                    logger.exception("Не удалось создать секции почасовой статистики")
+
+            try:
+                await flush_clicks(redis_client)
+            except Exception:
+                logger.exception("Не удалось записать клики в БД")
+    except asyncio.CancelledError:
+        # при остановке сбрасываем остаток
+        try:
+            await flush_clicks(redis_client)
+        except Exception:
+            logger.exception("Не удалось записать клики в БД при остановке")
+        raise
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import random
+import string
+from sqlalchemy import select, func
+from models.models import link_code_block_seq
+from config import SHORT_CODE_ALLOCATOR, SHORT_CODE_BLOCK_SIZE, SHORT_CODE_SECRET
+
+ALPHABET = string.digits + string.ascii_letters
+# сгенерированные коды на символ длиннее старых случайных, поэтому с ними не пересекаются
+CODE_LENGTH = 7
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+
+# номер из счетчика переводится в код сетью Фейстеля над 62^7 с ключом SHORT_CODE_SECRET (как в FF1:
+# номер делится на половины из 3 и 4 цифр base62, раунды чередуют модули). Это перестановка, поэтому коды
+# не повторяются, а без ключа по коду нельзя восстановить номер и перебрать соседние ссылки
+SHUFFLE_ROUNDS = 10
+SHUFFLE_LEFT_SPACE = len(ALPHABET) ** (CODE_LENGTH // 2)
+SHUFFLE_RIGHT_SPACE = len(ALPHABET) ** (CODE_LENGTH - CODE_LENGTH // 2)
+SHUFFLE_HASH = hashlib.blake2b(key=hashlib.sha256(SHORT_CODE_SECRET.encode()).digest(), digest_size=8)
+
+
+def generate_short_code(length: int = 6) -> str:
+    characters = string.ascii_letters + string.digits
+    short_code = ''.join(random.choice(characters) for _ in range(length))
+    return short_code
+
+
+def encode_base62(number: int, length: int = CODE_LENGTH) -> str:
+    chars = []
+    for _ in range(length):
+        number, rest = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[rest])
+    return ''.join(reversed(chars))
+
+
+def _shuffle_round(round_number: int, half: int) -> int:
+    round_hash = SHUFFLE_HASH.copy()
+    round_hash.update(bytes((round_number,)) + half.to_bytes(4, "big"))
+    return int.from_bytes(round_hash.digest(), "big")
+
+
+def shuffle_counter(number: int) -> int:
+    left, right = divmod(number, SHUFFLE_RIGHT_SPACE)
+    for round_number in range(SHUFFLE_ROUNDS):
+        space = SHUFFLE_LEFT_SPACE if round_number % 2 == 0 else SHUFFLE_RIGHT_SPACE
+        left, right = right, (left + _shuffle_round(round_number, right)) % space
+    return left * SHUFFLE_RIGHT_SPACE + right
+
+
+# случайные коды, как раньше: возможны коллизии
+class RandomAllocator:
+
+    async def allocate(self, db) -> str:
+        return generate_short_code()
+
+    async def allocate_many(self, db, count: int) -> list:
+        return [generate_short_code() for _ in range(count)]
+
+
+# уникальные коды из счетчика: воркер резервирует в БД блок номеров
+# и раздает коды из него без обращений к БД
+class SequenceBlockAllocator:
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def _reserve_block(self, db):
+        result = await db.execute(select(link_code_block_seq.next_value()))
+        block = result.scalar_one()
+        self._next = block * self.block_size
+        self._end = self._next + self.block_size
+
+        if self._end > CODE_SPACE:
+            raise Exception("Short code space is exhausted")
+
+    async def allocate(self, db) -> str:
+        async with self._lock:
+            if self._next >= self._end:
+                await self._reserve_block(db)
+            number = self._next
+            self._next += 1
+
+        return encode_base62(shuffle_counter(number))
+
+    # для пакетного создания: все недостающие блоки резервируются одним запросом
+    async def allocate_many(self, db, count: int) -> list:
+        async with self._lock:
+            numbers = list(range(self._next, min(self._end, self._next + count)))
+            self._next += len(numbers)
+
+            missing = count - len(numbers)
+            if missing > 0:
+                blocks_needed = -(-missing // self.block_size)
+                result = await db.execute(
+                    select(link_code_block_seq.next_value())
+                    .select_from(func.generate_series(1, blocks_needed))
+                )
+                for block in result.scalars().all():
+                    self._next = block * self.block_size
+                    self._end = self._next + self.block_size
+                    if self._end > CODE_SPACE:
+                        raise Exception("Short code space is exhausted")
+
+                    take = min(missing, self.block_size)
+                    numbers.extend(range(self._next, self._next + take))
+                    self._next += take
+                    missing -= take
+
+        return [encode_base62(shuffle_counter(number)) for number in numbers]
+
+
+ALLOCATORS = {
+    "random": lambda: RandomAllocator(),
+    "sequence": lambda: SequenceBlockAllocator(SHORT_CODE_BLOCK_SIZE),
+}
+
+allocator = ALLOCATORS[SHORT_CODE_ALLOCATOR]()
+
+
+async def allocate_short_code(db) -> str:
+    return await allocator.allocate(db)
+
+
+async def allocate_short_codes(db, count: int) -> list:
+    return await allocator.allocate_many(db, count)
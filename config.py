@@ -12,5 +12,126 @@ REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = os.getenv("REDIS_PORT")
 APP_PORT = os.getenv("APP_PORT")
 
+# пул соединений с Redis
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "1"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "1"))
+# префикс ключей кэша ссылок
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "fl:l:")
+# время жизни ключей кэша: не больше CACHE_MAX_TTL и не больше срока жизни ссылки,
+# уменьшается на случайную долю до CACHE_TTL_JITTER, чтобы ключи не истекали одновременно
+CACHE_MAX_TTL = int(os.getenv("CACHE_MAX_TTL", "3600"))
+CACHE_TTL_JITTER = float(os.getenv("CACHE_TTL_JITTER", "0.1"))
+# продлевать ключ при чтении из Redis (GETEX на CACHE_MAX_TTL)
+CACHE_SLIDING_TTL = os.getenv("CACHE_SLIDING_TTL", "false").lower() == "true"
+
+# пул соединений с Postgres (на один воркер)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# логирование SQL: "" (выключено), "info" или "debug"
+DB_ECHO = os.getenv("DB_ECHO", "").lower()
+if DB_ECHO not in ("", "false", "true", "info", "debug"):
+    raise RuntimeError(f"Некорректное значение DB_ECHO: '{DB_ECHO}', ожидается пусто, false, true, info или debug")
+# уровень логов приложения (фоновые задачи, токены сброса пароля и верификации без почты)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+if LOG_LEVEL not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+    raise RuntimeError(f"Некорректное значение LOG_LEVEL: '{LOG_LEVEL}', ожидается DEBUG, INFO, WARNING, ERROR или CRITICAL")
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+# число воркеров gunicorn и лимит соединений Postgres, который они делят
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_MAX_CONNECTIONS_BUDGET = int(os.getenv("DB_MAX_CONNECTIONS_BUDGET", "0"))
+
 DATABASE_URL_A = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# реплики для чтения: "host:port" через запятую, учетные данные и БД - как у основной
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+DB_REPLICA_URLS = [f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{host}/{DB_NAME}" for host in DB_REPLICA_HOSTS]
+DB_REPLICA_POOL_SIZE = int(os.getenv("DB_REPLICA_POOL_SIZE", os.getenv("DB_POOL_SIZE", "10")))
+DB_REPLICA_MAX_OVERFLOW = int(os.getenv("DB_REPLICA_MAX_OVERFLOW", os.getenv("DB_MAX_OVERFLOW", "5")))
+# реплика с отставанием больше DB_REPLICA_MAX_LAG секунд не используется, пока не догонит
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+# TTL кэша для ссылок, прочитанных с реплики: после изменения ссылки старый URL
+# может отдаваться не дольше DB_REPLICA_MAX_LAG + DB_REPLICA_CACHE_TTL секунд
+DB_REPLICA_CACHE_TTL = int(os.getenv("DB_REPLICA_CACHE_TTL", "30"))
+
+# буферизация кликов
+CLICKS_FLUSH_INTERVAL = float(os.getenv("CLICKS_FLUSH_INTERVAL", "5"))
+CLICKS_FLUSH_BATCH_SIZE = int(os.getenv("CLICKS_FLUSH_BATCH_SIZE", "1000"))
+
+# локальный (L1) кэш воркера перед Redis
+L1_CACHE_MAX_SIZE = int(os.getenv("L1_CACHE_MAX_SIZE", "10000"))
+L1_CACHE_TTL = float(os.getenv("L1_CACHE_TTL", "30"))
+# ссылки, созданные в другом воркере, станут видны не позже чем через это время
+L1_CACHE_NEGATIVE_TTL = float(os.getenv("L1_CACHE_NEGATIVE_TTL", "5"))
+
+# генерация коротких кодов: "sequence" (блоки из последовательности в БД) или "random"
+SHORT_CODE_ALLOCATOR = os.getenv("SHORT_CODE_ALLOCATOR", "sequence")
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000"))
+# ключ перестановки номеров в коды для "sequence", общий для всех воркеров. Не меняйте его после запуска:
+# новые коды могут совпасть с уже выданными
+SHORT_CODE_SECRET = os.getenv("SHORT_CODE_SECRET", "")
+if SHORT_CODE_ALLOCATOR == "sequence" and not SHORT_CODE_SECRET:
+    raise RuntimeError("Для SHORT_CODE_ALLOCATOR=sequence нужно задать SHORT_CODE_SECRET")
+
+# пакетное создание ссылок
+# размер тела запроса проверяется по Content-Length до чтения, поэтому слишком большой пакет отклоняется целиком,
+# а принятый записывается пачками по мере чтения. 16 МБ - порядка 150 тысяч ссылок
+LINKS_BATCH_MAX_BYTES = int(os.getenv("LINKS_BATCH_MAX_BYTES", str(16 * 1024 * 1024)))
+# пачка вставляется одним INSERT с 9 параметрами на строку, а asyncpg принимает не больше 32767 параметров
+LINKS_BATCH_MAX_CHUNK_SIZE = 32767 // 9
+LINKS_BATCH_CHUNK_SIZE = min(int(os.getenv("LINKS_BATCH_CHUNK_SIZE", "1000")), LINKS_BATCH_MAX_CHUNK_SIZE)
+
+# удаление истекших ссылок
+LINK_REAPER_INTERVAL = float(os.getenv("LINK_REAPER_INTERVAL", "60"))
+LINK_REAPER_BATCH_SIZE = int(os.getenv("LINK_REAPER_BATCH_SIZE", "1000"))
+LINK_REAPER_BATCH_PAUSE = float(os.getenv("LINK_REAPER_BATCH_PAUSE", "0.1"))
+# сколько секунд после истечения ссылка еще отдает 410, прежде чем будет удалена
+LINK_REAPER_GRACE_PERIOD = float(os.getenv("LINK_REAPER_GRACE_PERIOD", "86400"))
+
+# прогрев кэша самыми популярными ссылками
+CACHE_WARMUP_ON_STARTUP = os.getenv("CACHE_WARMUP_ON_STARTUP", "true").lower() == "true"
+CACHE_WARMUP_TOP_N = int(os.getenv("CACHE_WARMUP_TOP_N", "100000"))
+CACHE_WARMUP_CHUNK_SIZE = int(os.getenv("CACHE_WARMUP_CHUNK_SIZE", "1000"))
+# ограничение скорости прогрева, ключей в секунду
+CACHE_WARMUP_RATE = float(os.getenv("CACHE_WARMUP_RATE", "20000"))
+
+# объединение одновременных промахов кэша по одному коду
+SINGLE_FLIGHT_LEASE_MS = int(os.getenv("SINGLE_FLIGHT_LEASE_MS", "2000"))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.02"))
+
+# постраничный вывод и потоковая выгрузка ссылок
+LINKS_PAGE_DEFAULT_LIMIT = int(os.getenv("LINKS_PAGE_DEFAULT_LIMIT", "100"))
+LINKS_PAGE_MAX_LIMIT = int(os.getenv("LINKS_PAGE_MAX_LIMIT", "1000"))
+LINKS_STREAM_CHUNK_SIZE = int(os.getenv("LINKS_STREAM_CHUNK_SIZE", "1000"))
+
+# кэш проверенных JWT и данных пользователей
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+# сколько секунд воркер не перепроверяет подпись уже проверенного токена
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "60"))
+AUTH_USER_LOCAL_TTL = float(os.getenv("AUTH_USER_LOCAL_TTL", "30"))
+AUTH_USER_REDIS_TTL = int(os.getenv("AUTH_USER_REDIS_TTL", "300"))
+
+# ограничение частоты запросов: "маршрут:область=rate/burst" через запятую, область - user или ip;
+# маршруты: shorten, shorten_batch, redirect, write, read. По умолчанию ограничений нет: лимиты по ip
+# без RATE_LIMIT_TRUST_PROXY за балансировщиком делили бы одно ведро на всех клиентов
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# брать IP клиента из X-Forwarded-For (только за доверенным прокси)
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+
+# фильтр Блума по существующим коротким кодам: несуществующие коды получают 404 без запроса к БД.
+# Размер битовой строки и число хэшей считаются из ожидаемого числа ссылок и доли ложных срабатываний
+BLOOM_FILTER_ENABLED = os.getenv("BLOOM_FILTER_ENABLED", "true").lower() == "true"
+BLOOM_EXPECTED_ITEMS = int(os.getenv("BLOOM_EXPECTED_ITEMS", "10000000"))
+BLOOM_FALSE_POSITIVE_RATE = float(os.getenv("BLOOM_FALSE_POSITIVE_RATE", "0.01"))
+# пересборка из таблицы links, когда фильтра нет в Redis или он старше этого периода, секунд
+# (0 - только когда фильтра нет);
+# удаленные коды остаются в фильтре до пересборки
+BLOOM_REBUILD_INTERVAL = float(os.getenv("BLOOM_REBUILD_INTERVAL", "86400"))
+BLOOM_REBUILD_CHUNK_SIZE = int(os.getenv("BLOOM_REBUILD_CHUNK_SIZE", "2000"))
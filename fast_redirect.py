@@ -0,0 +1,136 @@
+from datetime import datetime, timezone
+from urllib.parse import quote
+from cache import local_cache, queue_cache_get, load_cached_value, cache_missing_link, MISSING_LINK, REDIS_GET_SECONDS
+from ratelimit import client_ip, queue_rate_limit, pipeline_retry_after, check_rate_limit
+from clicks import record_click, queue_click, uncount_click
+from bloom import queue_bloom_check, bloom_absent
+from metrics import REDIRECTS
+
+LINKS_PREFIX = "/links/"
+
+NOT_FOUND_BODY = '{"detail":"Ссылка не найдена"}'.encode()
+TOO_MANY_REQUESTS_BODY = '{"detail":"Слишком много запросов, повторите позже"}'.encode()
+
+FAST_REDIRECTS = REDIRECTS.labels("307", "fast")
+FAST_NOT_FOUND = REDIRECTS.labels("404", "fast")
+FAST_TOO_MANY_REQUESTS = REDIRECTS.labels("429", "fast")
+
+
+async def send_json(send, status, body, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _expired(cached_url, now):
+    return cached_url['expires_at'] is not None and cached_url['expires_at'] < now
+
+
+# ASGI-middleware: отдает редирект для ссылок из кэша без сессии БД, DI и pydantic.
+# При промахе запрос уходит в обычный обработчик redirect_to_original.
+class FastRedirectMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+        self._reserved = None
+
+    # статические GET-маршруты вида /links/<name>, которые нельзя принимать за короткий код
+    def reserved_names(self, scope):
+        if self._reserved is None:
+            self._reserved = {
+                route.path[len(LINKS_PREFIX):]
+                for route in scope["app"].routes
+                if route.path.startswith(LINKS_PREFIX)
+                and "{" not in route.path
+                and "/" not in route.path[len(LINKS_PREFIX):]
+            }
+        return self._reserved
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or not scope["path"].startswith(LINKS_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        short_code = scope["path"][len(LINKS_PREFIX):]
+        if not short_code or "/" in short_code or short_code in self.reserved_names(scope):
+            await self.app(scope, receive, send)
+            return
+
+        redis_client = scope["app"].state.redis
+        ip = client_ip(scope["headers"], scope.get("client"))
+
+        # при промахе локального кэша лимит и фильтр Блума проверяются в том же пайплайне,
+        # что и чтение из Redis
+        now = datetime.now(timezone.utc)
+        cached_url = local_cache.get(short_code)
+        click_recorded = False
+        if cached_url is None:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                limited = queue_rate_limit(pipe, "redirect", ip)
+                queue_cache_get(pipe, short_code)
+                checked = queue_bloom_check(pipe, short_code)
+                with REDIS_GET_SECONDS.time():
+                    results = await pipe.execute(raise_on_error=False)
+            if limited:
+                rate_result, *results = results
+            cached_data, *bloom_results = results
+            if isinstance(cached_data, Exception):
+                raise cached_data
+            retry_after = await pipeline_retry_after(rate_result, redis_client, "redirect", ip) if limited else 0
+            cached_url = load_cached_value(short_code, cached_data)
+            # кода точно нет в БД: запоминаем в локальном кэше и отвечаем 404 ниже
+            if cached_url is None and checked and bloom_absent(*bloom_results):
+                cache_missing_link(short_code)
+                cached_url = MISSING_LINK
+        elif cached_url is not MISSING_LINK and not _expired(cached_url, now):
+            # попадание в L1: лимит проверяется в одном пайплайне с учетом клика,
+            # клик отклоненного запроса списывается обратно
+            async with redis_client.pipeline(transaction=False) as pipe:
+                limited = queue_rate_limit(pipe, "redirect", ip)
+                queue_click(pipe, short_code)
+                results = await pipe.execute(raise_on_error=False)
+            for result in results[-2:]:
+                if isinstance(result, Exception):
+                    raise result
+            retry_after = await pipeline_retry_after(results[0], redis_client, "redirect", ip) if limited else 0
+            if retry_after:
+                await uncount_click(short_code, redis_client)
+            click_recorded = True
+        else:
+            retry_after = await check_rate_limit(redis_client, "redirect", ip)
+
+        if retry_after:
+            FAST_TOO_MANY_REQUESTS.inc()
+            await send_json(send, 429, TOO_MANY_REQUESTS_BODY, [(b"retry-after", str(retry_after).encode())])
+            return
+        scope.setdefault("state", {})["rate_limit_checked"] = True
+
+        if cached_url is MISSING_LINK:
+            FAST_NOT_FOUND.inc()
+            await send_json(send, 404, NOT_FOUND_BODY)
+            return
+
+        # промах или истекшая ссылка: полная обработка с проверками и ответом 410
+        if not cached_url or _expired(cached_url, now):
+            scope["state"]["link_cache_checked"] = True
+            await self.app(scope, receive, send)
+            return
+
+        if not click_recorded:
+            await record_click(short_code, redis_client)
+        FAST_REDIRECTS.inc()
+
+        location = quote(cached_url['original_url'], safe=":/%#?=@[]!$&'()*+,;")
+        await send({
+            "type": "http.response.start",
+            "status": 307,
+            "headers": [(b"location", location.encode()), (b"content-length", b"0")],
+        })
+        await send({"type": "http.response.body", "body": b""})
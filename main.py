@@ -1,21 +1,72 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+from fastapi import FastAPI, Response
 from contextlib import asynccontextmanager
-from auth.db import create_db_and_tables
+from auth.db import create_db_and_tables, validate_pool_budget, get_pool_stats
+from auth.replicas import run_replica_health_checks, replica_set
 from routers.auth_routes import router as auth_router
 from routers.links import router as links_router
-from config import APP_PORT
+from config import APP_PORT, CACHE_WARMUP_ON_STARTUP, LOG_LEVEL, LOG_FORMAT
+from cache import create_redis_client, close_redis_client, run_invalidation_listener, local_cache
+from clicks import run_click_flusher
+from reaper import run_link_reaper, reaper_stats
+from warmup import run_cache_warmup
+from bloom_rebuild import run_bloom_filter_rebuild
+from fast_redirect import FastRedirectMiddleware
+from metrics import render_metrics
 import uvicorn
 
+# uvicorn настраивает только свои логгеры: без обработчика у корневого логгера info-сообщения приложения не выводятся
+logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    validate_pool_budget()
     await create_db_and_tables()
+    app.state.redis = create_redis_client()
+    background_tasks = [
+        asyncio.create_task(run_click_flusher(app.state.redis)),
+        asyncio.create_task(run_invalidation_listener(app.state.redis)),
+        asyncio.create_task(run_link_reaper(app.state.redis)),
+        asyncio.create_task(run_replica_health_checks()),
+        asyncio.create_task(run_bloom_filter_rebuild(app.state.redis)),
+    ]
+    if CACHE_WARMUP_ON_STARTUP:
+        background_tasks.append(asyncio.create_task(run_cache_warmup(app.state.redis)))
     yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await close_redis_client(app.state.redis)
 
 app = FastAPI(lifespan=lifespan)
+# редиректы из кэша обслуживаются до роутеров
+app.add_middleware(FastRedirectMiddleware)
 
 # маршруты аутентификации
 app.include_router(auth_router)
 app.include_router(links_router, prefix="/links", tags=["links"])
 
+
+@app.get("/cache/stats", tags=["cache"], summary="Статистика локального кэша воркера")
+async def cache_stats():
+    return local_cache.stats()
+
+
+@app.get("/reaper/stats", tags=["reaper"], summary="Статистика удаления истекших ссылок в воркере")
+async def link_reaper_stats():
+    return reaper_stats
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/db/pool", tags=["db"], summary="Состояние пула соединений с БД в воркере")
+async def db_pool_stats():
+    return {**get_pool_stats(), "replicas": replica_set.status()}
+
 # if __name__ == "__main__":
 #     uvicorn.run("main:app", reload=True, host="0.0.0.0", port=8000, log_level="debug")
@@ -0,0 +1,86 @@
+import functools
+import os
+import time
+from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest,
+                               CONTENT_TYPE_LATEST)
+from prometheus_client import multiprocess
+
+# Метрики в формате Prometheus, отдаются на /metrics.
+# При нескольких воркерах gunicorn нужно задать PROMETHEUS_MULTIPROC_DIR, иначе каждый воркер
+# отдает только свои значения.
+
+# границы бакетов под быстрые операции: от 0.1 мс до 1 с
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+CACHE_OPERATION_SECONDS = Histogram(
+    "fastlinks_cache_operation_seconds",
+    "Время операций с Redis-кэшем ссылок",
+    ["operation"],
+    buckets=FAST_BUCKETS,
+)
+
+CACHE_LOOKUPS = Counter(
+    "fastlinks_cache_lookups_total",
+    "Обращения к кэшам по уровням (l1, redis, auth_token, auth_user) и результату (hit, negative_hit, miss); "
+    "для фильтра Блума (bloom) - absent или maybe",
+    ["layer", "result"],
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "fastlinks_db_query_seconds",
+    "Время работы функций services.py с БД",
+    ["function"],
+    buckets=FAST_BUCKETS,
+)
+
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "fastlinks_db_pool_checkout_seconds",
+    "Ожидание соединения из пула БД",
+    buckets=FAST_BUCKETS,
+)
+
+DB_POOL_CHECKED_OUT = Gauge(
+    "fastlinks_db_pool_checked_out",
+    "Соединений БД, выданных из пула воркера",
+    multiprocess_mode="livesum",
+)
+
+REDIRECTS = Counter(
+    "fastlinks_redirects_total",
+    "Ответы на редиректы по коду статуса и пути обработки (fast - middleware, app - обработчик)",
+    ["status", "path"],
+)
+
+
+# замер времени асинхронной функции, работающей с БД; метка - имя функции
+def timed_db(func):
+    histogram = DB_QUERY_SECONDS.labels(func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+# счетчики ответов обработчика редиректа по статусу; дочерние метрики создаются заранее,
+# чтобы не искать метки на каждом запросе (FastRedirectMiddleware держит свои)
+APP_REDIRECTS = {status: REDIRECTS.labels(str(status), "app") for status in (307, 404, 410)}
+
+
+def count_redirect(status):
+    APP_REDIRECTS[status].inc()
+
+
+# тело ответа /metrics; в режиме нескольких процессов собирает значения всех воркеров
+def render_metrics():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
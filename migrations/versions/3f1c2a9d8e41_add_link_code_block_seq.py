@@ -0,0 +1,26 @@
+"""Add link code block sequence
+
+Revision ID: 3f1c2a9d8e41
+Revises: 95b0c8c41069
+Create Date: 2026-10-17 12:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9d8e41'
+down_revision: Union[str, None] = '95b0c8c41069'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('link_code_block_seq')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('link_code_block_seq')))
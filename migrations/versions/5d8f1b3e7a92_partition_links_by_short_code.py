@@ -0,0 +1,74 @@
+"""Partition links by short_code
+
+Copies the whole table under an EXCLUSIVE lock: reads keep working, but link writes
+(creation, updates, click flushes) wait until the migration finishes. Run it in a
+maintenance window; the copy takes roughly as long as a full INSERT ... SELECT of links.
+
+Revision ID: 5d8f1b3e7a92
+Revises: e1a9c3f7b254
+Create Date: 2026-10-18 10:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d8f1b3e7a92'
+down_revision: Union[str, None] = 'e1a9c3f7b254'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# должно совпадать с models.models.LINKS_HASH_PARTITIONS
+PARTITIONS = 16
+
+
+def _create_indexes():
+    op.create_index('ix_links_url_digest_created_at', 'links', ['url_digest', 'created_at', 'id'], unique=False)
+    op.create_index('ix_links_expires_at', 'links', ['expires_at'], unique=False,
+                    postgresql_where=sa.text('expires_at IS NOT NULL'))
+    op.create_index('ix_links_user_id_created_at', 'links', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def upgrade() -> None:
+    # Таблица пересоздается с копированием данных; на время копирования запись в links заблокирована.
+    # Уникальные ограничения секционированной таблицы должны включать ключ секционирования,
+    # поэтому первичный ключ становится (id, short_code), а уникальность custom_alias следует из
+    # уникальности short_code и проверки custom_alias = short_code.
+    op.execute("CREATE TABLE links_partitioned (LIKE links INCLUDING DEFAULTS) PARTITION BY HASH (short_code)")
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f"CREATE TABLE links_p{remainder} PARTITION OF links_partitioned "
+            f"FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})"
+        )
+
+    op.execute("LOCK TABLE links IN EXCLUSIVE MODE")
+    op.execute("INSERT INTO links_partitioned SELECT * FROM links")
+    op.drop_table('links')
+    op.rename_table('links_partitioned', 'links')
+
+    op.create_primary_key('links_pkey', 'links', ['id', 'short_code'])
+    op.create_unique_constraint('links_short_code_key', 'links', ['short_code'])
+    op.create_check_constraint('links_custom_alias_check', 'links',
+                               'custom_alias IS NULL OR custom_alias = short_code')
+    op.create_foreign_key('links_user_id_fkey', 'links', 'user', ['user_id'], ['id'])
+    _create_indexes()
+    # id больше не первичный ключ сам по себе; индекс создается на всех секциях
+    op.create_index('ix_links_id', 'links', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.execute("CREATE TABLE links_unpartitioned (LIKE links INCLUDING DEFAULTS)")
+    op.execute("LOCK TABLE links IN EXCLUSIVE MODE")
+    op.execute("INSERT INTO links_unpartitioned SELECT * FROM links")
+    # секции удаляются вместе с родительской таблицей
+    op.drop_table('links')
+    op.rename_table('links_unpartitioned', 'links')
+
+    op.create_primary_key('links_pkey', 'links', ['id'])
+    op.create_unique_constraint('links_short_code_key', 'links', ['short_code'])
+    op.create_unique_constraint('links_custom_alias_key', 'links', ['custom_alias'])
+    op.create_foreign_key('links_user_id_fkey', 'links', 'user', ['user_id'], ['id'])
+    _create_indexes()
@@ -0,0 +1,34 @@
+"""Make links created_at not null
+
+Revision ID: 7c3e9b1d4a56
+Revises: 5d8f1b3e7a92
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3e9b1d4a56'
+down_revision: Union[str, None] = '5d8f1b3e7a92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # created_at - ключ сортировки и курсора keyset-пагинации, поэтому NULL в нем недопустим.
+    # Старые строки без даты получают дату, из которой выводится срок действия по умолчанию
+    op.execute(
+        "UPDATE links SET created_at = COALESCE(expires_at - interval '1 month', last_accessed, now()) "
+        "WHERE created_at IS NULL"
+    )
+    op.alter_column('links', 'created_at', existing_type=sa.DateTime(timezone=True),
+                    server_default=sa.text('now()'), nullable=False)
+
+
+def downgrade() -> None:
+    op.alter_column('links', 'created_at', existing_type=sa.DateTime(timezone=True),
+                    server_default=None, nullable=True)
@@ -0,0 +1,40 @@
+"""Add link lookup indexes
+
+Revision ID: 8b2e4f6a1c03
+Revises: 3f1c2a9d8e41
+Create Date: 2026-10-17 13:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4f6a1c03'
+down_revision: Union[str, None] = '3f1c2a9d8e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('links', sa.Column('url_digest', sa.LargeBinary(), nullable=True))
+    # тот же sha256, что считает models.url_digest для новых строк
+    op.execute("UPDATE links SET url_digest = sha256(convert_to(original_url, 'UTF8')) WHERE url_digest IS NULL")
+
+    # индексы строятся без блокировки записи в таблицу
+    with op.get_context().autocommit_block():
+        op.create_index('ix_links_url_digest_created_at', 'links', ['url_digest', 'created_at', 'id'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_links_expires_at', 'links', ['expires_at'], unique=False,
+                        postgresql_where=sa.text('expires_at IS NOT NULL'), postgresql_concurrently=True)
+        op.create_index('ix_links_user_id', 'links', ['user_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_links_user_id', table_name='links', postgresql_concurrently=True)
+        op.drop_index('ix_links_expires_at', table_name='links', postgresql_concurrently=True)
+        op.drop_index('ix_links_url_digest_created_at', table_name='links', postgresql_concurrently=True)
+    op.drop_column('links', 'url_digest')
@@ -0,0 +1,43 @@
+"""Add links clicks top index
+
+Revision ID: 9a4f2c6e8b13
+Revises: 7c3e9b1d4a56
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4f2c6e8b13'
+down_revision: Union[str, None] = '7c3e9b1d4a56'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# должно совпадать с models.models.LINKS_HASH_PARTITIONS
+PARTITIONS = 16
+
+INDEX_DEFINITION = "(clicks DESC NULLS LAST, expires_at) WHERE clicks > 0"
+
+
+def upgrade() -> None:
+    # прогрев кэша читает ссылки по убыванию clicks; условие с now() в частичный индекс не записать,
+    # поэтому expires_at - второй столбец, и истекшие ссылки отсеиваются по индексу.
+    # CONCURRENTLY на секционированной таблице недоступен: индекс родителя создается пустым (ON ONLY),
+    # индексы секций - без блокировки записи, затем присоединяются к нему
+    op.execute(f"CREATE INDEX ix_links_clicks_top ON ONLY links {INDEX_DEFINITION}")
+    with op.get_context().autocommit_block():
+        for remainder in range(PARTITIONS):
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY links_p{remainder}_clicks_top_idx "
+                f"ON links_p{remainder} {INDEX_DEFINITION}"
+            )
+            op.execute(f"ALTER INDEX ix_links_clicks_top ATTACH PARTITION links_p{remainder}_clicks_top_idx")
+
+
+def downgrade() -> None:
+    # индексы секций удаляются вместе с индексом родителя
+    op.drop_index('ix_links_clicks_top', table_name='links')
@@ -0,0 +1,41 @@
+"""Add link click rollups
+
+Revision ID: c4d7a2e9b610
+Revises: 8b2e4f6a1c03
+Create Date: 2026-10-17 14:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d7a2e9b610'
+down_revision: Union[str, None] = '8b2e4f6a1c03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('link_clicks_hourly',
+    sa.Column('short_code', sa.String(), nullable=False),
+    sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('short_code', 'bucket'),
+    postgresql_partition_by='RANGE (bucket)'
+    )
+    # месячные секции создает приложение (services.ensure_click_partitions)
+    op.execute("CREATE TABLE link_clicks_hourly_default PARTITION OF link_clicks_hourly DEFAULT")
+    op.create_table('link_clicks_daily',
+    sa.Column('short_code', sa.String(), nullable=False),
+    sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('short_code', 'bucket')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('link_clicks_daily')
+    op.drop_table('link_clicks_hourly')
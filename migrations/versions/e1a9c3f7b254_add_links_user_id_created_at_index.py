@@ -0,0 +1,33 @@
+"""Add links user_id created_at index
+
+Revision ID: e1a9c3f7b254
+Revises: c4d7a2e9b610
+Create Date: 2026-10-17 18:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1a9c3f7b254'
+down_revision: Union[str, None] = 'c4d7a2e9b610'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # составной индекс обслуживает и поиск по user_id, и keyset-пагинацию /links/mine,
+    # поэтому одиночный индекс по user_id больше не нужен
+    with op.get_context().autocommit_block():
+        op.create_index('ix_links_user_id_created_at', 'links', ['user_id', 'created_at', 'id'],
+                        unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_links_user_id', table_name='links', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_links_user_id', 'links', ['user_id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_links_user_id_created_at', table_name='links', postgresql_concurrently=True)
@@ -1,11 +1,28 @@
 from sqlalchemy import TIMESTAMP, Boolean, func
+import hashlib
 import uuid
-from sqlalchemy import Column, String, Integer, ForeignKey, DateTime
+from sqlalchemy import (Column, String, Integer, BigInteger, ForeignKey, DateTime, Sequence, LargeBinary, Index,
+                        CheckConstraint)
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.dialects.postgresql import UUID
 
 Base = declarative_base()
 
+# links секционирована по хэшу short_code; число секций задается миграцией 5d8f1b3e7a92
+LINKS_HASH_PARTITIONS = 16
+
+# номера блоков коротких кодов, которые воркеры резервируют для себя
+link_code_block_seq = Sequence("link_code_block_seq", metadata=Base.metadata)
+
+
+# ключ поиска по оригинальному URL (HttpUrl уже нормализует URL при валидации)
+def url_digest(original_url: str) -> bytes:
+    return hashlib.sha256(original_url.encode()).digest()
+
+
+def _url_digest_default(context):
+    return url_digest(context.get_current_parameters()["original_url"])
+
 class User(Base):
     __tablename__ = "user"
 
@@ -24,13 +41,46 @@ class User(Base):
 class Link(Base):
     __tablename__ = "links"
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
     original_url = Column(String, nullable=False)
-    short_code = Column(String, unique=True, nullable=False)
-    custom_alias = Column(String, unique=True, nullable=True)
+    # входит в первичный ключ: уникальные ключи секционированной таблицы включают ключ секционирования
+    short_code = Column(String, primary_key=True, unique=True, nullable=False)
+    # уникальность следует из custom_alias = short_code
+    custom_alias = Column(String, nullable=True)
     clicks = Column(Integer, default=0)
-    created_at = Column(DateTime(timezone=True), default=func.now())
+    created_at = Column(DateTime(timezone=True), nullable=False, default=func.now(), server_default=func.now())
     last_accessed = Column(DateTime(timezone=True), nullable=True)
     expires_at = Column(DateTime(timezone=True), nullable=True)
     user_id = Column(UUID, ForeignKey("user.id"), nullable=True)
+    url_digest = Column(LargeBinary, nullable=True, default=_url_digest_default)
     user = relationship("User", back_populates="links")
+
+    __table_args__ = (
+        Index("ix_links_url_digest_created_at", "url_digest", "created_at", "id"),
+        Index("ix_links_expires_at", "expires_at", postgresql_where=expires_at.isnot(None)),
+        Index("ix_links_user_id_created_at", "user_id", "created_at", "id"),
+        # самые кликаемые ссылки для прогрева кэша (stream_top_links)
+        Index("ix_links_clicks_top", clicks.desc().nulls_last(), expires_at, postgresql_where=clicks > 0),
+        CheckConstraint("custom_alias IS NULL OR custom_alias = short_code", name="links_custom_alias_check"),
+        {"postgresql_partition_by": "HASH (short_code)"},
+    )
+
+
+# почасовые клики; таблица секционирована по месяцам, старые секции можно удалять целиком
+class LinkClicksHourly(Base):
+    __tablename__ = "link_clicks_hourly"
+
+    short_code = Column(String, primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    clicks = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = {"postgresql_partition_by": "RANGE (bucket)"}
+
+
+# дневные клики, агрегируются вместе с почасовыми
+class LinkClicksDaily(Base):
+    __tablename__ = "link_clicks_daily"
+
+    short_code = Column(String, primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    clicks = Column(BigInteger, nullable=False, default=0)
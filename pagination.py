@@ -0,0 +1,42 @@
+import base64
+import uuid
+from datetime import datetime
+from sqlalchemy import tuple_, literal
+
+# Курсоры для keyset-пагинации по (ключ сортировки, id): клиент получает непрозрачную строку
+# и передает ее за следующей страницей, смещение (OFFSET) не используется.
+# Ключ сортировки - created_at (datetime) или число кликов (int).
+
+
+def encode_cursor(key, link_id: str) -> str:
+    if isinstance(key, datetime):
+        raw = f"t:{key.isoformat()}|{link_id}"
+    else:
+        raw = f"n:{int(key)}|{link_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+# ValueError, если курсор поврежден или его ключ не того типа, что ожидается.
+# id возвращается строкой: links.id в схеме - VARCHAR, сравнение с uuid Postgres не поддерживает
+def decode_cursor(cursor: str, key_type=datetime):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        kind, rest = raw.split(":", 1)
+        key, link_id = rest.rsplit("|", 1)
+        if kind == "t" and key_type is datetime:
+            return datetime.fromisoformat(key), str(uuid.UUID(link_id))
+        if kind == "n" and key_type is int:
+            return int(key), str(uuid.UUID(link_id))
+    except Exception as e:
+        raise ValueError("Некорректный курсор") from e
+    raise ValueError("Курсор не подходит к выбранной сортировке")
+
+
+# условие "строка после курсора" для сортировки по (key, id) по возрастанию или убыванию;
+# значения курсора привязываются с типами колонок, а не выводятся из типов Python
+def after_cursor(key_column, id_column, after, descending=False):
+    key, link_id = after
+    cursor = tuple_(literal(key, key_column.type), literal(link_id, id_column.type))
+    if descending:
+        return tuple_(key_column, id_column) < cursor
+    return tuple_(key_column, id_column) > cursor
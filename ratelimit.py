@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import math
+from fastapi import Depends, HTTPException, Request
+from redis.exceptions import NoScriptError, RedisError
+from cache import get_redis
+from auth.users import get_optional_user
+from config import RATE_LIMITS, RATE_LIMIT_TRUST_PROXY
+
+logger = logging.getLogger(__name__)
+
+# Token bucket в Redis: у каждого ключа (маршрут, область, идентификатор) есть ведро на burst
+# запросов, которое пополняется со скоростью rate запросов в секунду.
+# Все ведра запроса (например, пользователя и IP) проверяются одним скриптом: запрос проходит,
+# только если токен есть в каждом из них. Время берется у Redis, поэтому часы воркеров не важны.
+# Ответ: {1, 0} - пропустить, {0, миллисекунд до появления токена} - отказать.
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local tokens = {}
+local retry_ms = 0
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local available = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now_ms
+    available = math.min(burst, available + math.max(0, now_ms - ts) * rate / 1000)
+    tokens[i] = available
+    if available < 1 then
+        retry_ms = math.max(retry_ms, math.ceil((1 - available) * 1000 / rate))
+    end
+end
+if retry_ms > 0 then
+    return {0, retry_ms}
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    redis.call('HSET', KEYS[i], 'tokens', tokens[i] - 1, 'ts', now_ms)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(burst * 1000 / rate))
+end
+return {1, 0}
+"""
+TOKEN_BUCKET_SHA = hashlib.sha1(TOKEN_BUCKET_SCRIPT.encode()).hexdigest()
+
+RATE_LIMIT_KEY_PREFIX = "fl:rl:"
+
+
+# RATE_LIMITS: "маршрут:область=rate/burst" через запятую, область - user или ip,
+# например "shorten:user=5/20,redirect:ip=100/200"
+def parse_rules(value):
+    rules = {}
+    for rule in filter(None, (part.strip() for part in value.split(","))):
+        try:
+            target, limit = rule.split("=")
+            route, scope = target.split(":")
+            rate, burst = limit.split("/")
+            rate, burst = float(rate), float(burst)
+        except ValueError:
+            raise RuntimeError(f"Некорректное правило RATE_LIMITS: '{rule}'")
+        if scope not in ("user", "ip") or rate <= 0 or burst < 1:
+            raise RuntimeError(f"Некорректное правило RATE_LIMITS: '{rule}'")
+        rules.setdefault(route, []).append((scope, rate, burst))
+    return rules
+
+
+rate_limit_rules = parse_rules(RATE_LIMITS)
+
+
+def client_ip(headers, client):
+    # headers - список пар (bytes, bytes) из ASGI scope
+    if RATE_LIMIT_TRUST_PROXY:
+        for name, value in headers:
+            if name == b"x-forwarded-for":
+                return value.decode().split(",")[0].strip()
+    return client[0] if client else "unknown"
+
+
+def user_scoped(route):
+    return any(scope == "user" for scope, _, _ in rate_limit_rules.get(route, ()))
+
+
+# ключи и аргументы скрипта для ведер маршрута; правила по пользователю пропускаются для анонимов
+def _buckets(route, ip, user_id):
+    keys, args = [], []
+    identities = {"ip": ip, "user": user_id}
+    for scope, rate, burst in rate_limit_rules.get(route, ()):
+        if identities[scope] is None:
+            continue
+        keys.append(f"{RATE_LIMIT_KEY_PREFIX}{route}:{scope}:{identities[scope]}")
+        args.extend((rate, burst))
+    return keys, args
+
+
+# ставит проверку в пайплайн (например, рядом с чтением кэша); False - для маршрута нет правил
+def queue_rate_limit(pipe, route, ip, user_id=None):
+    keys, args = _buckets(route, ip, user_id)
+    if not keys:
+        return False
+    pipe.evalsha(TOKEN_BUCKET_SHA, len(keys), *keys, *args)
+    return True
+
+
+# секунды до следующей попытки по ответу скрипта, 0 - запрос разрешен
+def retry_after(result):
+    allowed, retry_ms = result
+    return 0 if allowed else math.ceil(int(retry_ms) / 1000)
+
+
+# результат скрипта из пайплайна; скрипт мог пропасть из Redis (перезапуск, SCRIPT FLUSH) - тогда проверяем заново
+async def pipeline_retry_after(result, redis_client, route, ip, user_id=None):
+    if isinstance(result, NoScriptError):
+        return await check_rate_limit(redis_client, route, ip, user_id)
+    if isinstance(result, Exception):
+        logger.warning("Не удалось проверить лимит запросов: %s", result)
+        return 0
+    return retry_after(result)
+
+
+# одно обращение к Redis; при недоступности Redis запрос пропускается
+async def check_rate_limit(redis_client, route, ip, user_id=None):
+    keys, args = _buckets(route, ip, user_id)
+    if not keys:
+        return 0
+    try:
+        try:
+            result = await redis_client.evalsha(TOKEN_BUCKET_SHA, len(keys), *keys, *args)
+        except NoScriptError:
+            result = await redis_client.eval(TOKEN_BUCKET_SCRIPT, len(keys), *keys, *args)
+    except RedisError as e:
+        logger.warning("Не удалось проверить лимит запросов: %s", e)
+        return 0
+    return retry_after(result)
+
+
+def too_many_requests(retry_after_seconds):
+    return HTTPException(
+        status_code=429,
+        detail="Слишком много запросов, повторите позже",
+        headers={"Retry-After": str(retry_after_seconds)},
+    )
+
+
+# зависимость для маршрутов: dependencies=[Depends(rate_limit("shorten"))]
+def rate_limit(route):
+    async def check(request: Request, user_id, redis_client):
+        # запрос уже проверен в FastRedirectMiddleware
+        if request.scope.get("state", {}).get("rate_limit_checked"):
+            return
+        ip = client_ip(request.scope["headers"], request.client)
+        seconds = await check_rate_limit(redis_client, route, ip, user_id)
+        if seconds:
+            raise too_many_requests(seconds)
+
+    # пользователь нужен только для ключа ведра: анонимный запрос проверяется по правилам ip,
+    # а 401 для закрытых маршрутов возвращает их собственная зависимость get_current_user
+    if user_scoped(route):
+        async def dependency(request: Request, redis_client=Depends(get_redis),
+                             current_user=Depends(get_optional_user)):
+            await check(request, current_user.id if current_user else None, redis_client)
+    else:
+        async def dependency(request: Request, redis_client=Depends(get_redis)):
+            await check(request, None, redis_client)
+
+    return dependency
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from auth.db import async_session_maker
+from services import delete_expired_links
+from cache import delete_cached_links
+from config import (LINK_REAPER_INTERVAL, LINK_REAPER_BATCH_SIZE, LINK_REAPER_BATCH_PAUSE,
+                    LINK_REAPER_GRACE_PERIOD)
+
+logger = logging.getLogger(__name__)
+
+# показатели работы очистки в этом воркере
+reaper_stats = {
+    "runs": 0,
+    "failed_runs": 0,
+    "deleted_total": 0,
+    "last_run_at": None,
+    "last_run_deleted": 0,
+    "last_run_seconds": 0.0,
+}
+
+
+# удаляет истекшие ссылки пачками, пока они не закончатся
+async def reap_expired_links(redis_client):
+    started = time.monotonic()
+    expired_before = datetime.now(timezone.utc) - timedelta(seconds=LINK_REAPER_GRACE_PERIOD)
+    deleted = 0
+
+    while True:
+        async with async_session_maker() as db:
+            short_codes = await delete_expired_links(db, expired_before, LINK_REAPER_BATCH_SIZE)
+
+        await delete_cached_links(short_codes, redis_client)
+        deleted += len(short_codes)
+        reaper_stats["deleted_total"] += len(short_codes)
+
+        if len(short_codes) < LINK_REAPER_BATCH_SIZE:
+            break
+        # пауза между пачками, чтобы не занимать БД целиком
+        await asyncio.sleep(LINK_REAPER_BATCH_PAUSE)
+
+    reaper_stats["runs"] += 1
+    reaper_stats["last_run_at"] = datetime.now(timezone.utc)
+    reaper_stats["last_run_deleted"] = deleted
+    reaper_stats["last_run_seconds"] = time.monotonic() - started
+    return deleted
+
+
+# фоновая задача, запускается из lifespan
+async def run_link_reaper(redis_client):
+    while True:
+        await asyncio.sleep(LINK_REAPER_INTERVAL)
+        try:
+            deleted = await reap_expired_links(redis_client)
+            if deleted:
+                logger.info("Удалено истекших ссылок: %s", deleted)
+        except Exception:
+            reaper_stats["failed_runs"] += 1
+            logger.exception("Не удалось удалить истекшие ссылки")
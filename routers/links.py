@@ -1,29 +1,36 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Query
-from datetime import datetime, timezone
-import redis
-from auth.db import get_async_session
+import csv
+import io
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Request, Response
+from datetime import datetime, timedelta, timezone
+from auth.db import get_async_session, async_session_maker
+from auth.replicas import get_read_session, read_session_maker, read_with_fallback
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi.responses import RedirectResponse
-from typing import List
-from pydantic import HttpUrl
-from auth.schemas import LinkCreate, LinkUpdate, LinkResponse, LinkStatistics, CustomAlias
+from fastapi.responses import RedirectResponse, StreamingResponse
+from typing import List, Literal, Optional
+from config import (LINKS_BATCH_MAX_BYTES, LINKS_BATCH_CHUNK_SIZE, LINKS_PAGE_DEFAULT_LIMIT, LINKS_PAGE_MAX_LIMIT,
+                    LINKS_STREAM_CHUNK_SIZE, DB_REPLICA_CACHE_TTL)
+from pydantic import HttpUrl, ValidationError
+from auth.schemas import (LinkCreate, LinkUpdate, LinkResponse, LinkStatistics, ClickBucket, CustomAlias,
+                          LinkBatchItem, LinkBatchItemResult, LinkBatchResponse, UserLinkResponse)
 from dateutil.relativedelta import relativedelta
-from services import (create_short_url, delete_short_url, update_short_url, get_original_url,
-                      update_link_statistics, get_link_stats, create_custom_short, check_alias_uniq, search_short)
+from services import (create_short_url, create_short_urls_batch, delete_short_url, update_short_url, get_original_url,
+                      get_link_stats, get_link_click_series, create_custom_short, search_short,
+                      stream_search_short, get_user_links, stream_user_links)
 from auth.users import get_current_user
-from config import REDIS_HOST, REDIS_PORT
-from cache import get_cached_url, create_cache_url,delete_cached_link
+from cache import (get_cached_url, create_cache_url, create_cache_urls, delete_cached_link, replace_cached_link,
+                   cache_missing_link, get_redis, MISSING_LINK)
+from clicks import record_click, get_pending_clicks, move_pending_clicks
+from bloom import short_code_absent
+from single_flight import single_flight
+from metrics import count_redirect
+from pagination import encode_cursor, decode_cursor
+from ratelimit import rate_limit
 
 
 router = APIRouter()
 
-redis_client = redis.Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    decode_responses=True
-)
-
 @router.post("/shorten",
+             dependencies=[Depends(rate_limit("shorten"))],
              summary="Создать короткую ссылку",
              description="Этот эндпоинт создает короткую ссылку на основе предоставленного оригинального URL.",
              response_description="Возвращает информацию о созданной короткой ссылке.",
@@ -31,9 +38,10 @@ redis_client = redis.Redis(
 async def shorten_link(
         link: LinkCreate,
         db: AsyncSession = Depends(get_async_session),
+        redis_client=Depends(get_redis),
         current_user=Depends(get_current_user)
 ):
-    cached_data = get_cached_url(link.custom_alias, redis_client)
+    cached_data = await get_cached_url(link.custom_alias, redis_client)
 
     if cached_data:
         return LinkResponse(
@@ -49,6 +57,7 @@ async def shorten_link(
 
     short_url = await create_short_url(
         db,
+        redis_client,
         original_url=str(link.original_url),
         user_id=current_user.id,
         alias=link.custom_alias,
@@ -56,7 +65,7 @@ async def shorten_link(
     )
 
 
-    create_cache_url(
+    await create_cache_url(
         short_url.short_code,
         short_url.original_url,
         short_url.clicks,
@@ -74,10 +83,128 @@ async def shorten_link(
     )
 
 
+# элементы пакета: из JSON-массива или построчно из NDJSON-потока
+async def _iter_batch_payload(request: Request):
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+        return
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+
+    if not isinstance(payload, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Ожидается JSON-массив ссылок или NDJSON"
+        )
+
+    for item in payload:
+        yield item
+
+
+def _parse_batch_item(raw):
+    if isinstance(raw, bytes):
+        item = LinkBatchItem.model_validate_json(raw)
+    else:
+        item = LinkBatchItem.model_validate(raw)
+
+    alias = item.custom_alias if item.custom_alias != "string" else None
+    # срок как у /shorten: заданный срок плюс месяц, без срока - месяц от создания (в create_short_urls_batch)
+    expires_at = item.expires_at
+    if expires_at is not None:
+        expires_at = expires_at.replace(tzinfo=expires_at.tzinfo or timezone.utc) + relativedelta(months=1)
+
+    return str(item.original_url), alias, expires_at
+
 
+# пакет больше LINKS_BATCH_MAX_BYTES отклоняется до чтения тела и записи в БД; без Content-Length размер
+# заранее неизвестен, и часть пакета успела бы записаться до превышения лимита
+def _check_batch_size(request: Request):
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        raise HTTPException(
+            status_code=status.HTTP_411_LENGTH_REQUIRED,
+            detail="Для пакетного создания нужен заголовок Content-Length"
+        )
+    if not content_length.isdigit():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректный Content-Length")
+    if int(content_length) > LINKS_BATCH_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Превышен максимальный размер пакета: {LINKS_BATCH_MAX_BYTES} байт"
+        )
+
+
+async def _create_batch_chunk(db, redis_client, user_id, chunk):
+    links = await create_short_urls_batch(db, redis_client, user_id, [item for _, item in chunk])
+    await create_cache_urls([link for link in links if link is not None], redis_client)
+
+    results = []
+    for (index, (_, alias, _)), link in zip(chunk, links):
+        if link is None:
+            error = f"Такая ссылка '{alias}' уже существует" if alias else "Не удалось выделить короткий код"
+            results.append(LinkBatchItemResult(index=index, error=error))
+        else:
+            results.append(LinkBatchItemResult(
+                index=index,
+                short_code=link.short_code,
+                original_url=link.original_url,
+                expires_at=link.expires_at,
+            ))
+    return results
+
+
+@router.post("/shorten/batch",
+             dependencies=[Depends(rate_limit("shorten_batch"))],
+             summary="Создать короткие ссылки пакетом",
+             description="Этот эндпоинт создает короткие ссылки для JSON-массива или NDJSON-потока оригинальных URL. "
+                         "Ошибки возвращаются для каждого элемента отдельно и не прерывают обработку пакета.",
+             response_model=LinkBatchResponse)
+async def shorten_links_batch(
+        request: Request,
+        db: AsyncSession = Depends(get_async_session),
+        redis_client=Depends(get_redis),
+        current_user=Depends(get_current_user)
+):
+    _check_batch_size(request)
+
+    # элементы проверяются по мере чтения и записываются пачками: из разобранных элементов в памяти только текущая пачка
+    results = []
+    chunk = []
+    index = 0
+    async for raw in _iter_batch_payload(request):
+        try:
+            chunk.append((index, _parse_batch_item(raw)))
+        except ValidationError as e:
+            error = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results.append(LinkBatchItemResult(index=index, error=error))
+        index += 1
+
+        if len(chunk) >= LINKS_BATCH_CHUNK_SIZE:
+            results.extend(await _create_batch_chunk(db, redis_client, current_user.id, chunk))
+            chunk = []
+
+    if chunk:
+        results.extend(await _create_batch_chunk(db, redis_client, current_user.id, chunk))
+
+    results.sort(key=lambda result: result.index)
+    failed = sum(1 for result in results if result.error)
+
+    return LinkBatchResponse(created=len(results) - failed, failed=failed, results=results)
 
 
 @router.put("/{short_code}",
+            dependencies=[Depends(rate_limit("write"))],
             summary="Обновление короткой ссылки",
             description="Этот эндпоинт генерирует новую короткую ссылку для оригинального URL",
             response_model=LinkResponse)
@@ -85,6 +212,7 @@ async def update_link(
         short_code: str,
         link_update: LinkUpdate,
         db: AsyncSession = Depends(get_async_session),
+        redis_client=Depends(get_redis),
         current_user=Depends(get_current_user)
 ):
     expires_at = link_update.expires_at
@@ -97,6 +225,7 @@ async def update_link(
 
     updated_link = await update_short_url(
         db,
+        redis_client,
         short_code,
         current_user.id,
         original_url=str(link_update.original_url) if link_update.original_url else None,
@@ -104,14 +233,18 @@ async def update_link(
         expires_at=expires_at
     )
 
-    delete_cached_link(short_code, redis_client)
+    # агрегаты кликов перенесены в update_short_url, здесь - клики, еще не записанные в БД
+    if updated_link.short_code != short_code:
+        await move_pending_clicks(short_code, updated_link.short_code, redis_client)
 
-    create_cache_url(
+    await replace_cached_link(
+        [short_code],
         updated_link.short_code,
         updated_link.original_url,
         updated_link.clicks,
         updated_link.expires_at,
-        redis_client
+        redis_client,
+        last_accessed=updated_link.last_accessed
     )
 
     return LinkResponse(
@@ -123,48 +256,69 @@ async def update_link(
         expires_at=updated_link.expires_at,
     )
 
+# длина временного ряда по умолчанию и максимальная для каждой детализации
+SERIES_DEFAULT_RANGE = {"hour": timedelta(days=2), "day": timedelta(days=30)}
+SERIES_MAX_RANGE = {"hour": timedelta(days=31), "day": timedelta(days=366 * 3)}
+
+
 @router.get("/{short_code}/stats",
+            dependencies=[Depends(rate_limit("read"))],
             summary="Вывод статистики использования короткой ссылки",
-            description="Этот эндпоинт показывает сколько раз кликали на короткую ссылку и время последнего клика",
+            description="Этот эндпоинт показывает сколько раз кликали на короткую ссылку и время последнего клика. "
+                        "С параметром granularity возвращает также почасовой или дневной ряд кликов.",
             response_model=LinkStatistics)
 
 async def get_link_statistics(
         short_code: str,
-        db: AsyncSession = Depends(get_async_session)
+        granularity: Optional[Literal["hour", "day"]] = Query(None, description="Детализация ряда кликов"),
+        since: Optional[datetime] = Query(None, description="Начало периода ряда кликов"),
+        until: Optional[datetime] = Query(None, description="Конец периода ряда кликов"),
+        db: AsyncSession = Depends(get_async_session),
+        read_db: AsyncSession = Depends(get_read_session),
+        redis_client=Depends(get_redis)
 ):
-    cached = get_cached_url(short_code, redis_client)
-
-    if cached:
-        return LinkStatistics(
-            original_url=cached['original_url'],
-            short_code=cached['short_code'],
-            clicks=cached['clicks'],
-            last_accessed=cached['last_accessed'],
-            expires_at=cached['expires_at']
+    # клики всегда из БД: снимок в кэше не увеличивается при переходах и отстает от записанных кликов
+    pending_clicks = await get_pending_clicks(short_code, redis_client)
+    # с реплики; только что созданная ссылка, которой там еще нет, читается из основной БД
+    stats, _ = await read_with_fallback(read_db, db, get_link_stats, short_code, primary_on_empty=True)
+
+    if not stats:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Ссылка с кодом '{short_code}' не найдена"
+        )
+    if (stats.clicks or 0) + pending_clicks == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Не было переходов"
         )
-    else:
-        stats = await get_link_stats(db, short_code)
 
-        if not stats:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Ссылка с кодом '{short_code}' не найдена"
-            )
-        if stats.clicks == 0:
+    statistics = LinkStatistics(
+        original_url=stats.original_url,
+        short_code=stats.short_code,
+        clicks=(stats.clicks or 0) + pending_clicks,
+        last_accessed=stats.last_accessed,
+        expires_at=stats.expires_at
+    )
+
+    if granularity:
+        until = until.replace(tzinfo=until.tzinfo or timezone.utc) if until else datetime.now(timezone.utc)
+        since = since.replace(tzinfo=since.tzinfo or timezone.utc) if since else until - SERIES_DEFAULT_RANGE[granularity]
+
+        if until - since > SERIES_MAX_RANGE[granularity]:
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Не было переходов"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Слишком длинный период для выбранной детализации"
             )
 
-        return LinkStatistics(
-            original_url=stats.original_url,
-            short_code=stats.short_code,
-            clicks=stats.clicks,
-            last_accessed=stats.last_accessed,
-            expires_at=stats.expires_at
-        )
+        series, _ = await read_with_fallback(read_db, db, get_link_click_series,
+                                             short_code, granularity, since, until)
+        statistics.series = [ClickBucket(bucket=row.bucket, clicks=row.clicks) for row in series]
+
+    return statistics
 
 @router.post("/shorten/custom",
+             dependencies=[Depends(rate_limit("shorten"))],
              summary="Изменение короткой ссылки и времени",
              description="Этот эндпоинт позволяет задать кастомный алиас для ссылки и изменить время жизни существующей ссылки",
              response_model=LinkResponse)
@@ -172,6 +326,7 @@ async def get_link_statistics(
 async def create_custom_link(
         link: CustomAlias,
         db: AsyncSession = Depends(get_async_session),
+        redis_client=Depends(get_redis),
         current_user=Depends(get_current_user)
 ):
     if link.custom_alias == "string":
@@ -186,33 +341,34 @@ async def create_custom_link(
             detail="Для создания кастомной ссылки необходимо указать алиас"
         )
 
-    is_unique = await check_alias_uniq(db, link.custom_alias)
-
-    if not is_unique:
-        if link.new_expires_at != link.expires_at:
-            expires_at = link.new_expires_at.replace(tzinfo=timezone.utc)
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-            )
+    # срок для нового алиаса; существующий алиас получает new_expires_at, если тот отличается от expires_at
+    if link.expires_at:
+        expires_at = link.expires_at.replace(tzinfo=timezone.utc) + relativedelta(months=1)
     else:
-        expires_at = None
-        if link.expires_at:
-            expires_at = link.expires_at.replace(tzinfo=timezone.utc) + relativedelta(months=1)
-        else:
-            expires_at = datetime.now(timezone.utc) + relativedelta(months=1)
+        expires_at = datetime.now(timezone.utc) + relativedelta(months=1)
+    new_expires_at = None
+    if link.new_expires_at is not None and link.new_expires_at != link.expires_at:
+        new_expires_at = link.new_expires_at.replace(tzinfo=timezone.utc)
 
     short_url = await create_custom_short(
         db,
+        redis_client,
         original_url=str(link.original_url),
         user_id=current_user.id,
         custom_alias=link.custom_alias,
-        expires_at=expires_at
+        expires_at=expires_at,
+        new_expires_at=new_expires_at
     )
 
-    delete_cached_link(link.short_code, redis_client)
-
-    create_cache_url(short_url.custom_alias, short_url.original_url, 0, short_url.expires_at, redis_client)
+    await replace_cached_link(
+        [link.short_code],
+        short_url.short_code,
+        short_url.original_url,
+        short_url.clicks,
+        short_url.expires_at,
+        redis_client,
+        last_accessed=short_url.last_accessed
+    )
 
     return LinkResponse(
         id=short_url.id,
@@ -224,86 +380,281 @@ async def create_custom_link(
     )
 
 
+def _parse_cursor(cursor, key_type=datetime):
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor, key_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _link_response(row):
+    return LinkResponse(
+        id=row.id,
+        original_url=row.original_url,
+        short_code=row.short_code,
+        clicks=row.clicks,
+        created_at=row.created_at,
+        expires_at=row.expires_at,
+    )
+
+
+# NDJSON-поток: сессия открывается внутри генератора, т.к. сессия из Depends закрывается до отправки ответа
+async def _stream_search_ndjson(url, after):
+    async with read_session_maker()() as db:
+        async for rows in stream_search_short(db, url, LINKS_STREAM_CHUNK_SIZE, after):
+            yield "".join(_link_response(row).model_dump_json() + "\n" for row in rows)
+
+
 @router.get("/search",
+            dependencies=[Depends(rate_limit("read"))],
             summary="Поиск короткой ссылки",
-            description="Этот эндпоинт позволяет найти короткую ссылку в БД по оригинальному URL",
+            description="Этот эндпоинт позволяет найти короткую ссылку в БД по оригинальному URL. "
+                        "Результаты отдаются страницами по limit штук, курсор следующей страницы "
+                        "возвращается в заголовке X-Next-Cursor. С format=ndjson все совпадения "
+                        "после курсора отдаются потоком, по одной ссылке на строку",
             response_model=List[LinkResponse])
 async def search_by_url(
+        response: Response,
         url: HttpUrl = Query(..., description="Оригинальный URL для поиска"),
+        limit: int = Query(LINKS_PAGE_DEFAULT_LIMIT, ge=1, le=LINKS_PAGE_MAX_LIMIT, description="Размер страницы"),
+        cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor"),
+        format: Literal["json", "ndjson"] = Query("json", description="json - страница, ndjson - поток"),
         # current_user=Depends(get_current_user),
         db: AsyncSession = Depends(get_async_session),
+        read_db: AsyncSession = Depends(get_read_session),
 
 ):
+    after = _parse_cursor(cursor)
+
+    if format == "ndjson":
+        return StreamingResponse(_stream_search_ndjson(str(url), after), media_type="application/x-ndjson")
 
-    links = await search_short(db, str(url))
+    # на одну строку больше, чтобы понять, есть ли следующая страница
+    links, _ = await read_with_fallback(read_db, db, search_short, str(url), limit + 1, after)
 
-    if not links:
+    if not links and after is None:
         raise HTTPException(status_code=404, detail="Ссылки не найдены")
 
-    response = [
-        LinkResponse(
-            id=link.id,
-            original_url=link.original_url,
-            short_code=link.short_code,
-            clicks=link.clicks,
-            created_at=link.created_at,
-            expires_at=link.expires_at,
-        )
-        for link in links
-    ]
+    if len(links) > limit:
+        links = links[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(links[-1].created_at, links[-1].id)
+
+    return [_link_response(link) for link in links]
+
+EXPORT_COLUMNS = ("short_code", "original_url", "custom_alias", "clicks", "created_at", "expires_at", "last_accessed")
+
+
+# фильтры и сортировка списка ссылок пользователя, общие для /mine и /mine/export
+class UserLinksFilter:
+
+    def __init__(
+            self,
+            status: Literal["all", "active", "expired"] = Query("all", description="Все, действующие или истекшие"),
+            created_from: Optional[datetime] = Query(None, description="Созданы не раньше"),
+            created_to: Optional[datetime] = Query(None, description="Созданы раньше"),
+            sort: Literal["created_at", "clicks"] = Query("created_at", description="Сортировка по убыванию"),
+            cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor"),
+    ):
+        self.sort = sort
+        self.filters = {
+            "status": status,
+            "created_from": _with_utc(created_from),
+            "created_to": _with_utc(created_to),
+            "sort": sort,
+            "after": _parse_cursor(cursor, datetime if sort == "created_at" else int),
+        }
+
+
+def _with_utc(value):
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _user_link_response(row):
+    return UserLinkResponse(
+        id=row.id,
+        original_url=row.original_url,
+        short_code=row.short_code,
+        custom_alias=row.custom_alias,
+        clicks=row.clicks,
+        created_at=row.created_at,
+        expires_at=row.expires_at,
+        last_accessed=row.last_accessed,
+    )
+
+
+@router.get("/mine",
+            dependencies=[Depends(rate_limit("read"))],
+            summary="Ссылки пользователя",
+            description="Этот эндпоинт возвращает ссылки текущего пользователя страницами по limit штук. "
+                        "Курсор следующей страницы возвращается в заголовке X-Next-Cursor",
+            response_model=List[UserLinkResponse])
+async def list_my_links(
+        response: Response,
+        limit: int = Query(LINKS_PAGE_DEFAULT_LIMIT, ge=1, le=LINKS_PAGE_MAX_LIMIT, description="Размер страницы"),
+        links_filter: UserLinksFilter = Depends(),
+        db: AsyncSession = Depends(get_async_session),
+        current_user=Depends(get_current_user)
+):
+    # на одну строку больше, чтобы понять, есть ли следующая страница
+    links = await get_user_links(db, current_user.id, limit + 1, **links_filter.filters)
+
+    if len(links) > limit:
+        links = links[:limit]
+        # оба ключа сортировки не бывают NULL: created_at NOT NULL, clicks через coalesce
+        response.headers["X-Next-Cursor"] = encode_cursor(links[-1].sort_key, links[-1].id)
+
+    return [_user_link_response(link) for link in links]
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def _stream_user_links(user_id, filters, format):
+    async with async_session_maker() as db:
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+
+        async for rows in stream_user_links(db, user_id, LINKS_STREAM_CHUNK_SIZE, **filters):
+            if format == "csv":
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(
+                    [_csv_value(getattr(row, column)) for column in EXPORT_COLUMNS]
+                    for row in rows
+                )
+                yield buffer.getvalue()
+            else:
+                yield "".join(_user_link_response(row).model_dump_json() + "\n" for row in rows)
+
+
+@router.get("/mine/export",
+            dependencies=[Depends(rate_limit("read"))],
+            summary="Выгрузка ссылок пользователя",
+            description="Этот эндпоинт отдает потоком все ссылки текущего пользователя в CSV или NDJSON "
+                        "с теми же фильтрами, что и /links/mine")
+async def export_my_links(
+        format: Literal["csv", "ndjson"] = Query("csv", description="Формат выгрузки"),
+        links_filter: UserLinksFilter = Depends(),
+        current_user=Depends(get_current_user)
+):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _stream_user_links(current_user.id, links_filter.filters, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="links.{format}"'},
+    )
+
+
+# загружает ссылку из БД и кэширует ее, если она еще действует;
+# для ссылок без expires_at срок считается от created_at
+async def _load_link(db, read_db, short_code, redis_client):
+    link, replica = await read_with_fallback(read_db, db, get_original_url, short_code)
+    if not link:
+        return None
+
+    expires_at = link.expires_at
+    if not expires_at and link.created_at:
+        expires_at = link.created_at + relativedelta(months=1)
+
+    if not expires_at or expires_at >= datetime.now(timezone.utc):
+        # данные с реплики могут отставать, поэтому кэшируются ненадолго
+        await create_cache_url(short_code, link.original_url, link.clicks, expires_at, redis_client, link.last_accessed,
+                               max_ttl=DB_REPLICA_CACHE_TTL if replica else None)
+
+    return {
+        'original_url': link.original_url,
+        'short_code': link.short_code,
+        'clicks': link.clicks,
+        'expires_at': expires_at,
+        'last_accessed': link.last_accessed
+    }
 
-    return response
 
 @router.get("/{short_code}",
+            dependencies=[Depends(rate_limit("redirect"))],
             summary="Перенаправить на оригинальный адрес",
             description="Этот эндпоинт перенаправляет на оригинальный URL по указанной короткой ссылке",
             )
 async def redirect_to_original(
         short_code: str,
+        request: Request,
         db: AsyncSession = Depends(get_async_session),
+        read_db: AsyncSession = Depends(get_read_session),
+        redis_client=Depends(get_redis),
 ):
-    # проверка кэша
-    cached_url = get_cached_url(short_code, redis_client)
+    # проверка кэша и фильтра Блума (пропускается, если FastRedirectMiddleware их уже проверила)
+    cached_url = None
+    if not getattr(request.state, "link_cache_checked", False):
+        cached_url = await get_cached_url(short_code, redis_client)
+        if cached_url is None and await short_code_absent(short_code, redis_client):
+            cache_missing_link(short_code)
+            cached_url = MISSING_LINK
     now = datetime.now(timezone.utc)
 
+    if cached_url is MISSING_LINK:
+        count_redirect(404)
+        raise HTTPException(status_code=404, detail="Ссылка не найдена")
+
     if cached_url:
-        create_cache_url(short_code, cached_url['original_url'], cached_url['clicks']+1, cached_url['expires_at'], redis_client, now)
-        await update_link_statistics(db, short_code)
+        # срок проверяется и для кэша: ключ может пережить ссылку на величину TTL
+        if cached_url['expires_at'] and cached_url['expires_at'] < now:
+            count_redirect(410)
+            raise HTTPException(status_code=410, detail="Срок действия ссылки истек")
+
+        await record_click(short_code, redis_client)
+        count_redirect(307)
         return RedirectResponse(url=cached_url['original_url'])
     else:
-        link = await get_original_url(db, short_code)
+        # одновременные промахи по одному коду ждут один запрос к БД
+        link = await single_flight(
+            short_code,
+            lambda: _load_link(db, read_db, short_code, redis_client),
+            lambda: get_cached_url(short_code, redis_client),
+            redis_client
+        )
 
         if not link:
+            cache_missing_link(short_code)
+            count_redirect(404)
             raise HTTPException(status_code=404, detail="Ссылка не найдена")
 
-        if not link.expires_at:
-            if link.created_at:
-                expiration_date = link.created_at + relativedelta(months=1)
-                if now > expiration_date:
-                    raise HTTPException(status_code=410, detail="Срок действия ссылки истек")
-        elif link.expires_at < now:
+        if link['expires_at'] and link['expires_at'] < now:
+            count_redirect(410)
             raise HTTPException(status_code=410, detail="Срок действия ссылки истек")
 
-        await update_link_statistics(db, link.short_code)
-
-        create_cache_url(short_code, link.original_url, link.clicks, link.expires_at, redis_client, now)
+        await record_click(short_code, redis_client)
+        count_redirect(307)
 
-        return RedirectResponse(url=link.original_url)
+        return RedirectResponse(url=link['original_url'])
 
 
 @router.delete("/{short_code}",
+               dependencies=[Depends(rate_limit("write"))],
                summary="Удаление ссылки",
                description="Этот эндпоинт удаляет короткую ссылку",
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_link(
         short_code: str,
         db: AsyncSession = Depends(get_async_session),
+        redis_client=Depends(get_redis),
         current_user=Depends(get_current_user)
 ):
     deleted = await delete_short_url(db, short_code, current_user.id)
 
     if deleted:
-        delete_cached_link(short_code, redis_client)
+        await delete_cached_link(short_code, redis_client)
         return None
 
 
@@ -1,7 +1,5 @@
-import random
-import string
 import uuid
-from sqlalchemy import update
+from sqlalchemy import update, delete, values, column, func, text, or_, literal, String, Integer, DateTime
 from urllib.parse import unquote
 from datetime import datetime, timezone
 from dateutil.relativedelta import relativedelta
@@ -9,46 +7,63 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
-from models.models import Link
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models.models import Link, LinkClicksHourly, LinkClicksDaily, url_digest
+from code_allocator import allocate_short_code, allocate_short_codes
+from metrics import timed_db
+from pagination import after_cursor
+from bloom import add_short_codes, confirm_short_codes
 
-import logging
-logging.basicConfig()
-logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
 
+# колонки, которые запросы на запись возвращают через RETURNING вместо повторного SELECT
+LINK_RETURNING = (Link.id, Link.original_url, Link.short_code, Link.custom_alias, Link.clicks,
+                  Link.created_at, Link.expires_at, Link.last_accessed)
 
-def generate_short_code(length: int = 6) -> str:
-    characters = string.ascii_letters + string.digits
-    short_code = ''.join(random.choice(characters) for _ in range(length))
-    return short_code
 
+# Новые коды добавляются в фильтр Блума до коммита и еще раз в собираемый фильтр после коммита,
+# поэтому функции создания принимают redis_client.
+# Удаленные коды остаются в фильтре до пересборки (bloom_rebuild.py).
 
-async def create_short_url(db, original_url, user_id, alias=None, expires_at=None):
+# нарушение уникальности (SQLSTATE 23505). Имя ограничения не проверяется: в секционированной
+# таблице ошибку сообщает индекс секции (links_pN_short_code_key)
+def _unique_violation(e: IntegrityError):
+    return getattr(e.orig, "sqlstate", None) == "23505"
+
+
+@timed_db
+async def create_short_url(db, redis_client, original_url, user_id, alias=None, expires_at=None):
     created_at = datetime.now(timezone.utc)
     if expires_at is None:
         expires_at = created_at + relativedelta(months=1)
 
     if alias == "string":
         alias = None
-    new_url = Link(
+    # все значения известны заранее, поэтому строка возвращается из самого INSERT, без refresh
+    stmt = pg_insert(Link).values(
+        id=str(uuid.uuid4()),
         original_url=original_url,
-        short_code=generate_short_code() if not alias else alias,
+        url_digest=url_digest(original_url),
+        short_code=await allocate_short_code(db) if not alias else alias,
         custom_alias=alias,
         user_id=user_id,
+        clicks=0,
         created_at=created_at,
         expires_at=expires_at
-    )
-    db.add(new_url)
+    ).returning(*LINK_RETURNING)
 
     try:
+        result = await db.execute(stmt)
+        new_url = result.one()
+        await add_short_codes([new_url.short_code], redis_client)
         await db.commit()
-        await db.refresh(new_url)
+        await confirm_short_codes([new_url.short_code], redis_client)
         return new_url
 
     except IntegrityError as e:
         await db.rollback()
         error_message = str(e.orig)
 
-        if "links_short_code_key" in error_message or "links_custom_alias_key" in error_message:
+        if _unique_violation(e):
             if alias:
                 raise  HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -60,30 +75,138 @@ async def create_short_url(db, original_url, user_id, alias=None, expires_at=Non
         raise Exception(f"Failed to create short URL: {error_message}") from e
 
 
+@timed_db
+async def create_short_urls_batch(db: AsyncSession, redis_client, user_id: uuid.UUID, items):
+    # items: список (original_url, alias, expires_at), вставляется одним INSERT ... RETURNING.
+    # Для каждого элемента возвращает созданную строку или None, если код уже занят
+    created_at = datetime.now(timezone.utc)
+    codes = iter(await allocate_short_codes(db, sum(1 for _, alias, _ in items if not alias)))
+
+    rows = []
+    for original_url, alias, expires_at in items:
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "original_url": original_url,
+            "url_digest": url_digest(original_url),
+            "short_code": alias or next(codes),
+            "custom_alias": alias,
+            "user_id": user_id,
+            "clicks": 0,
+            "created_at": created_at,
+            "expires_at": expires_at or created_at + relativedelta(months=1),
+        })
+
+    query = (
+        pg_insert(Link)
+        .values(rows)
+        .on_conflict_do_nothing()
+        .returning(Link.id, Link.short_code, Link.original_url, Link.clicks, Link.created_at, Link.expires_at,
+                   Link.last_accessed)
+    )
+    result = await db.execute(query)
+    created = {row.short_code: row for row in result}
+    await add_short_codes(list(created), redis_client)
+    await db.commit()
+    await confirm_short_codes(list(created), redis_client)
+
+    # при повторе кода внутри пакета вставлена только первая строка
+    links = []
+    for row in rows:
+        links.append(created.pop(row["short_code"], None))
+    return links
+
+
+async def stream_short_codes(db: AsyncSession, chunk_size: int):
+    # все короткие коды через серверный курсор, пачками по chunk_size
+    result = await db.stream(select(Link.short_code).execution_options(yield_per=chunk_size))
+    async for rows in result.scalars().partitions(chunk_size):
+        yield rows
+
+
+async def stream_top_links(db: AsyncSession, limit: int, chunk_size: int):
+    # самые кликаемые неистекшие ссылки через серверный курсор, пачками по chunk_size;
+    # идет по индексу ix_links_clicks_top без сортировки таблицы, ссылки без кликов не прогреваются
+    now = datetime.now(timezone.utc)
+    result = await db.stream(
+        select(Link.short_code, Link.original_url, Link.clicks, Link.expires_at, Link.last_accessed)
+        .where(Link.clicks > 0, or_(Link.expires_at.is_(None), Link.expires_at > now))
+        .order_by(Link.clicks.desc().nulls_last())
+        .limit(limit)
+        .execution_options(yield_per=chunk_size)
+    )
+    async for rows in result.partitions(chunk_size):
+        yield rows
+
+
+@timed_db
 async def get_original_url(db: AsyncSession, short_code: str) -> Link:
     result = await db.execute(select(Link).where(Link.short_code == short_code))
     return result.scalars().first()
 
 
 
-async def update_link_statistics(db: AsyncSession, short_code: str):
-    now = datetime.now(timezone.utc)
+@timed_db
+async def update_link_statistics_batch(db: AsyncSession, stats):
+    # stats: список (short_code, прирост кликов, время последнего перехода)
+    if not stats:
+        return
 
-    now_naive = now.replace(tzinfo=None)
+    deltas = values(
+        column("short_code", String),
+        column("delta", Integer),
+        column("last_accessed", DateTime(timezone=True)),
+        name="deltas"
+    ).data(stats)
 
     query = (
         update(Link)
-        .where(Link.short_code == short_code)
+        .where(Link.short_code == deltas.c.short_code)
         .values(
-            clicks=Link.clicks + 1,
-            last_accessed=now_naive
+            clicks=func.coalesce(Link.clicks, 0) + deltas.c.delta,
+            last_accessed=func.greatest(Link.last_accessed, deltas.c.last_accessed)
         )
+        .execution_options(synchronize_session=False)
     )
 
     await db.execute(query)
+
+    # те же приросты попадают в почасовые и дневные агрегаты. Буфер хранит по коду только сумму и время
+    # последнего перехода, поэтому все клики порции относятся к часу последнего перехода: на границе часа
+    # в следующий час может попасть до CLICKS_FLUSH_INTERVAL секунд кликов (больше, если сброс не удавался)
+    now = datetime.now(timezone.utc)
+    hourly = []
+    daily = []
+    for short_code, delta, last_accessed in stats:
+        hour = (last_accessed or now).astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        hourly.append({"short_code": short_code, "bucket": hour, "clicks": delta})
+        daily.append({"short_code": short_code, "bucket": hour.replace(hour=0), "clicks": delta})
+
+    for model, rows in ((LinkClicksHourly, hourly), (LinkClicksDaily, daily)):
+        upsert = pg_insert(model).values(rows)
+        await db.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[model.short_code, model.bucket],
+                set_={"clicks": model.clicks + upsert.excluded.clicks}
+            )
+        )
+
     await db.commit()
 
 
+# создает месячные секции почасовой статистики на текущий и следующий месяц
+@timed_db
+async def ensure_click_partitions(db: AsyncSession, now: datetime = None):
+    month = (now or datetime.now(timezone.utc)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for start in (month, month + relativedelta(months=1)):
+        end = start + relativedelta(months=1)
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS link_clicks_hourly_{start:%Y%m} PARTITION OF link_clicks_hourly "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+    await db.commit()
+
+
+@timed_db
 async def delete_short_url(db: AsyncSession, short_code: str, user_id: uuid.UUID):
     # проверка существует ли ссылка с таким кодом
     result = await db.execute(select(Link).where(Link.short_code == short_code))
@@ -107,8 +230,31 @@ async def delete_short_url(db: AsyncSession, short_code: str, user_id: uuid.UUID
     return True
 
 
+@timed_db
+async def delete_expired_links(db: AsyncSession, expired_before: datetime, limit: int):
+    # удаляет пачку истекших ссылок; SKIP LOCKED позволяет нескольким воркерам чистить таблицу параллельно
+    expired = (
+        select(Link.id)
+        .where(Link.expires_at < expired_before)
+        .order_by(Link.expires_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        delete(Link)
+        .where(Link.id.in_(expired.scalar_subquery()))
+        .returning(Link.short_code)
+        .execution_options(synchronize_session=False)
+    )
+    short_codes = result.scalars().all()
+    await db.commit()
+    return short_codes
+
+
+@timed_db
 async def update_short_url(
         db: AsyncSession,
+        redis_client,
         short_code: str,
         user_id: uuid.UUID,
         original_url: str = None,
@@ -116,128 +262,239 @@ async def update_short_url(
         new_short_code: str = None,
         expires_at: datetime = None
 ):
-    result = await db.execute(select(Link).where(Link.short_code == short_code))
-    old_link = result.scalars().first()
-
-    if not old_link:
+    # владелец проверяется до выделения кода, чтобы чужие запросы не расходовали коды;
+    # строка блокируется до конца транзакции. Затем один UPDATE ... RETURNING: строка и ее id сохраняются,
+    # меняются код, URL и срок
+    owner = (await db.execute(
+        select(Link.user_id).where(Link.short_code == short_code).with_for_update()
+    )).first()
+    if owner is None:
         raise HTTPException(status_code=404, detail=f"Ссылка с кодом '{short_code}' не найдена")
-
-    if old_link.user_id != user_id:
+    if owner.user_id != user_id:
         raise HTTPException(status_code=403, detail="У вас нет прав на обновление этой ссылки")
 
-    await db.delete(old_link)
-    await db.flush()
-
-    created_at = datetime.now(timezone.utc)
-
     if expires_at is None:
-        expires_at = created_at + relativedelta(months=1)
+        expires_at = datetime.now(timezone.utc) + relativedelta(months=1)
     else:
         expires_at = expires_at + relativedelta(months=1)
 
-    final_original_url = original_url if original_url is not None else old_link.original_url
-    new_short_code = generate_short_code()
-
-    new_link = Link(
-        original_url=final_original_url,
-        short_code=new_short_code if not alias else alias,
-        custom_alias=alias,
-        user_id=user_id,
-        created_at=created_at,
-        expires_at=expires_at,
-        clicks=0
-    )
-
-    db.add(new_link)
+    values = {
+        "short_code": await allocate_short_code(db) if not alias else alias,
+        "custom_alias": alias,
+        "expires_at": expires_at,
+    }
+    if original_url is not None:
+        values["original_url"] = original_url
+        values["url_digest"] = url_digest(original_url)
 
     try:
+        result = await db.execute(
+            update(Link)
+            .where(Link.short_code == short_code, Link.user_id == user_id)
+            .values(**values)
+            .returning(*LINK_RETURNING)
+            .execution_options(synchronize_session=False)
+        )
+        updated_link = result.one()
+        # статистика переходов переезжает на новый код в той же транзакции
+        if updated_link.short_code != short_code:
+            await _move_click_rollups(db, short_code, updated_link.short_code)
+        await add_short_codes([updated_link.short_code], redis_client)
         await db.commit()
-        await db.refresh(new_link)
-        return new_link
     except IntegrityError as e:
         await db.rollback()
         raise HTTPException(
             status_code=409,
-            detail=f"Не удалось создать новую ссылку: {str(e.orig)}"
+            detail=f"Не удалось обновить ссылку: {str(e.orig)}"
         )
 
+    await confirm_short_codes([updated_link.short_code], redis_client)
+    return updated_link
 
-async def get_link_stats(db: AsyncSession, short_code: str) -> Link:
-    result = await db.execute(select(Link).where(Link.short_code == short_code))
-    link = result.scalars().all()
-    return link
 
+async def _move_click_rollups(db: AsyncSession, old_short_code: str, new_short_code: str):
+    # почасовые и дневные агрегаты старого кода прибавляются к агрегатам нового
+    for model in (LinkClicksHourly, LinkClicksDaily):
+        upsert = pg_insert(model).from_select(
+            ["short_code", "bucket", "clicks"],
+            select(literal(new_short_code), model.bucket, model.clicks).where(model.short_code == old_short_code)
+        )
+        await db.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[model.short_code, model.bucket],
+                set_={"clicks": model.clicks + upsert.excluded.clicks}
+            )
+        )
+        await db.execute(delete(model).where(model.short_code == old_short_code))
+
+
+@timed_db
+async def get_link_stats(db: AsyncSession, short_code: str):
+    # только нужные для статистики колонки, без загрузки ORM-объекта
+    result = await db.execute(
+        select(Link.original_url, Link.short_code, Link.clicks, Link.last_accessed, Link.expires_at)
+        .where(Link.short_code == short_code)
+    )
+    return result.first()
 
+
+@timed_db
+async def get_link_click_series(db: AsyncSession, short_code: str, granularity: str,
+                                since: datetime, until: datetime):
+    model = LinkClicksHourly if granularity == "hour" else LinkClicksDaily
+    result = await db.execute(
+        select(model.bucket, model.clicks)
+        .where(model.short_code == short_code, model.bucket >= since, model.bucket < until)
+        .order_by(model.bucket)
+    )
+    return result.all()
+
+
+@timed_db
 async def check_alias_uniq(db: AsyncSession, alias: str) -> bool:
     result = await db.execute(select(Link).where(Link.short_code == alias))
     existing = result.scalars().first()
     return existing is None
 
 
+@timed_db
 async def create_custom_short(
         db: AsyncSession,
+        redis_client,
         original_url: str,
         user_id: uuid.UUID,
         custom_alias: str,
-        expires_at: datetime
-) -> Link:
-    created_at = datetime.now(timezone.utc)
-
-    existing_link = await db.execute(
-        select(Link).filter(Link.custom_alias == custom_alias)
-    )
-    existing_link = existing_link.scalar_one_or_none()
-
-    if existing_link:
-        if existing_link.expires_at == expires_at:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Алиас '{custom_alias}' уже используется с текущей датой истечения."
-            )
-
-        existing_link.original_url = original_url
-        existing_link.user_id = user_id
-        existing_link.expires_at = expires_at
-
-        try:
-            await db.commit()
-            await db.refresh(existing_link)
-            return existing_link
-
-        except IntegrityError as e:
-            await db.rollback()
-            raise Exception(f"Не удалось обновить короткую ссылку: {str(e.orig)}") from e
-
-    new_url = Link(
+        expires_at: datetime,
+        new_expires_at: datetime = None
+):
+    # один INSERT ... ON CONFLICT ... RETURNING: новый алиас создается со сроком expires_at,
+    # существующий обновляется на new_expires_at, только если он принадлежит пользователю
+    # и срок действительно меняется; без new_expires_at существующий алиас не трогается
+    insert_stmt = pg_insert(Link).values(
+        id=str(uuid.uuid4()),
         original_url=original_url,
+        url_digest=url_digest(original_url),
         short_code=custom_alias,
         custom_alias=custom_alias,
         user_id=user_id,
-        created_at=created_at,
+        clicks=0,
+        created_at=datetime.now(timezone.utc),
         expires_at=expires_at
     )
-
-    db.add(new_url)
+    if new_expires_at is None:
+        stmt = insert_stmt.on_conflict_do_nothing(index_elements=[Link.short_code])
+    else:
+        stmt = insert_stmt.on_conflict_do_update(
+            index_elements=[Link.short_code],
+            set_={
+                "original_url": insert_stmt.excluded.original_url,
+                "url_digest": insert_stmt.excluded.url_digest,
+                "expires_at": new_expires_at,
+            },
+            where=(Link.user_id == user_id)
+            & (Link.custom_alias == custom_alias)
+            & Link.expires_at.is_distinct_from(new_expires_at)
+        )
 
     try:
+        result = await db.execute(stmt.returning(*LINK_RETURNING))
+        link = result.first()
+        if link is not None:
+            await add_short_codes([link.short_code], redis_client)
         await db.commit()
-        await db.refresh(new_url)
-        return new_url
-
-
+        if link is not None:
+            await confirm_short_codes([link.short_code], redis_client)
     except IntegrityError as e:
         await db.rollback()
         error_message = str(e.orig)
 
-        if "links_short_code_key" in error_message or "links_custom_alias_key" in error_message:
+        if _unique_violation(e):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Алиас '{custom_alias}' уже используется"
             )
         raise Exception(f"Не удалось создать короткую ссылку: {error_message}") from e
 
+    if link is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Алиас '{custom_alias}' уже используется"
+        )
+    return link
+
 
-async def search_short(db: AsyncSession, original_url: str) -> Link:
+def _search_query(original_url: str, after=None):
     decoded_url = unquote(original_url)
-    result = await db.execute(select(Link).where(Link.original_url == decoded_url))
-    return result.scalars().all()
+    # поиск по индексу дайджеста, сравнение строк отсекает коллизии;
+    # индекс (url_digest, created_at, id) покрывает и сортировку, и условие курсора
+    query = (
+        select(Link.id, Link.original_url, Link.short_code, Link.clicks, Link.created_at, Link.expires_at)
+        .where(Link.url_digest == url_digest(decoded_url), Link.original_url == decoded_url)
+        .order_by(Link.created_at, Link.id)
+    )
+    if after is not None:
+        query = query.where(after_cursor(Link.created_at, Link.id, after))
+    return query
+
+
+@timed_db
+async def search_short(db: AsyncSession, original_url: str, limit: int, after=None):
+    # одна страница результатов после курсора after = (created_at, id)
+    result = await db.execute(_search_query(original_url, after).limit(limit))
+    return result.all()
+
+
+async def stream_search_short(db: AsyncSession, original_url: str, chunk_size: int, after=None):
+    # все совпадения через серверный курсор, пачками по chunk_size
+    result = await db.stream(
+        _search_query(original_url, after).execution_options(yield_per=chunk_size)
+    )
+    async for rows in result.partitions(chunk_size):
+        yield rows
+
+
+# ключи сортировки списка ссылок пользователя; обе сортировки - по убыванию
+USER_LINKS_SORT_KEYS = {
+    "created_at": Link.created_at,
+    "clicks": func.coalesce(Link.clicks, 0),
+}
+
+
+def _user_links_query(user_id: uuid.UUID, status: str = "all", created_from: datetime = None,
+                      created_to: datetime = None, sort: str = "created_at", after=None):
+    sort_key = USER_LINKS_SORT_KEYS[sort]
+    now = datetime.now(timezone.utc)
+    query = (
+        select(Link.id, Link.original_url, Link.short_code, Link.custom_alias, sort_key.label("sort_key"),
+               func.coalesce(Link.clicks, 0).label("clicks"), Link.created_at, Link.expires_at,
+               Link.last_accessed)
+        .where(Link.user_id == user_id)
+        .order_by(sort_key.desc(), Link.id.desc())
+    )
+    if status == "active":
+        query = query.where(or_(Link.expires_at.is_(None), Link.expires_at > now))
+    elif status == "expired":
+        query = query.where(Link.expires_at <= now)
+    if created_from is not None:
+        query = query.where(Link.created_at >= created_from)
+    if created_to is not None:
+        query = query.where(Link.created_at < created_to)
+    if after is not None:
+        query = query.where(after_cursor(sort_key, Link.id, after, descending=True))
+    return query
+
+
+@timed_db
+async def get_user_links(db: AsyncSession, user_id: uuid.UUID, limit: int, **filters):
+    # одна страница ссылок пользователя; filters - см. _user_links_query
+    result = await db.execute(_user_links_query(user_id, **filters).limit(limit))
+    return result.all()
+
+
+async def stream_user_links(db: AsyncSession, user_id: uuid.UUID, chunk_size: int, **filters):
+    # все ссылки пользователя через серверный курсор, без загрузки коллекции User.links
+    result = await db.stream(
+        _user_links_query(user_id, **filters).execution_options(yield_per=chunk_size)
+    )
+    async for rows in result.partitions(chunk_size):
+        yield rows
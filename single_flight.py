@@ -0,0 +1,76 @@
+import asyncio
+import time
+import uuid
+from config import SINGLE_FLIGHT_LEASE_MS, SINGLE_FLIGHT_POLL_INTERVAL
+
+# загрузки, которые сейчас выполняются в этом воркере
+_inflight = {}
+
+# снимает аренду, только если она все еще наша
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+# снимает блокировку или аренду по ключу, если ее не перехватил другой воркер
+async def release_lease(key, token, redis_client):
+    await redis_client.eval(RELEASE_LEASE_SCRIPT, 1, key, token)
+
+
+def _lease_key(key):
+    return f"fl:lease:{key}"
+
+
+# между воркерами: загружает тот, кто взял аренду в Redis, остальные ждут результат через wait_for
+async def _load_with_lease(key, loader, wait_for, redis_client):
+    token = uuid.uuid4().hex
+    if await redis_client.set(_lease_key(key), token, nx=True, px=SINGLE_FLIGHT_LEASE_MS):
+        try:
+            return await loader()
+        finally:
+            await release_lease(_lease_key(key), token, redis_client)
+
+    deadline = time.monotonic() + SINGLE_FLIGHT_LEASE_MS / 1000
+    while time.monotonic() < deadline:
+        await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        result = await wait_for()
+        if result is not None:
+            return result
+        # аренду отпустили, а результата нет (например, ссылка не найдена): загружаем сами
+        if not await redis_client.exists(_lease_key(key)):
+            break
+
+    return await loader()
+
+
+# внутри воркера: параллельные запросы с одним ключом ждут одну и ту же загрузку
+async def single_flight(key, loader, wait_for, redis_client):
+    future = _inflight.get(key)
+    if future is not None:
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            # отменили загружавший запрос, а не нас: пробуем заново
+            return await single_flight(key, loader, wait_for, redis_client)
+
+    future = asyncio.get_running_loop().create_future()
+    # исключение считается полученным, даже если ожидающих не было
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight[key] = future
+    try:
+        result = await _load_with_lease(key, loader, wait_for, redis_client)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _inflight.pop(key, None)
@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+from auth.db import async_session_maker
+from services import stream_top_links
+from cache import create_cache_urls, create_redis_client, close_redis_client
+from single_flight import release_lease
+from config import CACHE_WARMUP_TOP_N, CACHE_WARMUP_CHUNK_SIZE, CACHE_WARMUP_RATE, LOG_LEVEL, LOG_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# прогрев выполняет один воркер, остальные пропускают его
+WARMUP_LOCK_KEY = "fl:warmup:lock"
+WARMUP_LOCK_TTL = 600
+
+
+# загружает в Redis самые популярные ссылки пайплайнами, не быстрее CACHE_WARMUP_RATE ключей в секунду
+async def warm_cache(redis_client, top_n=CACHE_WARMUP_TOP_N, chunk_size=CACHE_WARMUP_CHUNK_SIZE,
+                     rate=CACHE_WARMUP_RATE):
+    token = uuid.uuid4().hex
+    if not await redis_client.set(WARMUP_LOCK_KEY, token, nx=True, ex=WARMUP_LOCK_TTL):
+        return 0
+
+    loaded = 0
+    started = time.monotonic()
+    try:
+        async with async_session_maker() as db:
+            async for links in stream_top_links(db, top_n, chunk_size):
+                await create_cache_urls(links, redis_client, overwrite=False)
+                loaded += len(links)
+
+                # не опережаем заданную скорость, чтобы не мешать живому трафику
+                ahead = loaded / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+    finally:
+        # блокировку могли перехватить, если прогрев шел дольше WARMUP_LOCK_TTL
+        await release_lease(WARMUP_LOCK_KEY, token, redis_client)
+
+    logger.info("Кэш прогрет: %s ссылок за %.1f с", loaded, time.monotonic() - started)
+    return loaded
+
+
+# фоновая задача, запускается из lifespan
+async def run_cache_warmup(redis_client):
+    try:
+        await warm_cache(redis_client)
+    except Exception:
+        logger.exception("Не удалось прогреть кэш")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Прогрев кэша Redis самыми популярными ссылками")
+    parser.add_argument("--top", type=int, default=CACHE_WARMUP_TOP_N, help="сколько ссылок загрузить")
+    parser.add_argument("--chunk-size", type=int, default=CACHE_WARMUP_CHUNK_SIZE, help="размер пачки")
+    parser.add_argument("--rate", type=float, default=CACHE_WARMUP_RATE, help="ключей в секунду")
+    args = parser.parse_args()
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    redis_client = create_redis_client()
+    try:
+        loaded = await warm_cache(redis_client, args.top, args.chunk_size, args.rate)
+        print(f"Загружено ссылок: {loaded}")
+    finally:
+        await close_redis_client(redis_client)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())